@@ -187,6 +187,18 @@ export interface ChatEvent {
   content?: string | Record<string, unknown>;
 }
 
+// SSE events arrive as compact [kind, content?] arrays; kind indexes this table
+// (must match TOKEN_EVENT/PROGRESS_EVENT/DONE_EVENT/ERROR_EVENT in chat.py)
+const CHAT_EVENT_TYPES: ChatEvent["type"][] = ["token", "progress", "done", "error"];
+
+/**
+ * Decode one SSE data payload into a ChatEvent.
+ */
+function parseChatEvent(data: string): ChatEvent {
+  const [kind, content] = JSON.parse(data) as [number, ChatEvent["content"]?];
+  return { type: CHAT_EVENT_TYPES[kind], content };
+}
+
 export interface CheckpointMessage {
   role: string;
   content: string;
@@ -299,38 +311,19 @@ export async function fetchThreadHistory(threadId: string): Promise<Checkpoint[]
   return response.json();
 }
 
+// A dropped chat stream is re-requested with the same request id this many
+// times; the backend replays the frames sent so far, which are skipped
+const STREAM_RETRIES = 2;
+const STREAM_RETRY_DELAY_MS = 500;
+
 /**
- * Send a chat message and receive streaming response via SSE.
- * Returns an async generator that yields ChatEvent objects.
+ * Yield the raw SSE data payloads of a response body, in order.
+ * Throws if the connection drops mid-stream.
  */
-export async function* streamChat(
-  message: string,
-  threadId: string,
-  userId: string,
-  attachments?: MessageAttachment[]
-): AsyncGenerator<ChatEvent, void, unknown> {
-  const response = await fetch(`${API_BASE}/api/chat`, {
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({
-      message,
-      thread_id: threadId,
-      user_id: userId,
-      attachments: attachments || [],
-    }),
-  });
-
-  if (!response.ok) {
-    const errorText = await response.text();
-    console.error("Chat request failed:", response.status, errorText);
-    yield { type: "error", content: `Failed to send message: ${response.status}` };
-    return;
-  }
-
+async function* readSSEData(response: Response): AsyncGenerator<string, void, unknown> {
   const reader = response.body?.getReader();
   if (!reader) {
-    yield { type: "error", content: "No response body" };
-    return;
+    throw new Error("No response body");
   }
 
   const decoder = new TextDecoder();
@@ -341,18 +334,11 @@ export async function* streamChat(
       const { done, value } = await reader.read();
       if (done) {
         // Process any remaining buffer
-        if (buffer.trim()) {
-          const remaining = buffer.trim();
-          if (remaining.startsWith("data: ")) {
-            try {
-              const event = JSON.parse(remaining.slice(6)) as ChatEvent;
-              yield event;
-            } catch {
-              console.error("Failed to parse remaining buffer:", remaining);
-            }
-          }
+        const remaining = buffer.trim();
+        if (remaining.startsWith("data: ")) {
+          yield remaining.slice(6);
         }
-        break;
+        return;
       }
 
       buffer += decoder.decode(value, { stream: true });
@@ -365,21 +351,11 @@ export async function* streamChat(
       for (const message of messages) {
         const trimmed = message.trim();
         if (!trimmed) continue;
-        
+
         // Handle multi-line SSE format
-        const lines = trimmed.split("\n");
-        for (const line of lines) {
+        for (const line of trimmed.split("\n")) {
           if (line.startsWith("data: ")) {
-            const data = line.slice(6);
-            try {
-              const event = JSON.parse(data) as ChatEvent;
-              yield event;
-              if (event.type === "done" || event.type === "error") {
-                return;
-              }
-            } catch (e) {
-              console.error("Failed to parse SSE data:", data, e);
-            }
+            yield line.slice(6);
           }
         }
       }
@@ -389,90 +365,117 @@ export async function* streamChat(
   }
 }
 
+/**
+ * POST a chat request and yield its SSE events until "done" or "error".
+ * If the connection drops first, the request is retried with the same
+ * request_id so the backend attaches it to the still-running turn instead
+ * of starting a new one; frames already delivered are skipped.
+ */
+async function* streamChatEvents(
+  path: string,
+  body: Record<string, unknown>,
+  label: string
+): AsyncGenerator<ChatEvent, void, unknown> {
+  let delivered = 0;
+
+  for (let attempt = 0; ; attempt++) {
+    if (attempt > 0) {
+      await new Promise((resolve) => setTimeout(resolve, STREAM_RETRY_DELAY_MS));
+    }
+
+    let seen = 0;
+    try {
+      const response = await fetch(`${API_BASE}${path}`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify(body),
+      });
+
+      if (!response.ok) {
+        const errorText = await response.text();
+        console.error(`${label} request failed:`, response.status, errorText);
+        yield { type: "error", content: `${label} failed: ${response.status}` };
+        return;
+      }
+
+      for await (const data of readSSEData(response)) {
+        // Replayed frames from an earlier attempt were already yielded
+        if (seen++ < delivered) continue;
+        delivered++;
+
+        let event: ChatEvent;
+        try {
+          event = parseChatEvent(data);
+        } catch (e) {
+          console.error("Failed to parse SSE data:", data, e);
+          continue;
+        }
+        yield event;
+        if (event.type === "done" || event.type === "error") {
+          return;
+        }
+      }
+    } catch (error) {
+      console.error(`${label} stream dropped:`, error);
+    }
+
+    // The stream ended without "done": the connection was lost
+    if (attempt >= STREAM_RETRIES) {
+      yield { type: "error", content: `${label} failed: connection lost` };
+      return;
+    }
+  }
+}
+
+/**
+ * Send a chat message and receive streaming response via SSE.
+ * Returns an async generator that yields ChatEvent objects.
+ * Dropped connections are retried under the same requestId, so they rejoin
+ * the running turn rather than starting a new one.
+ */
+export async function* streamChat(
+  message: string,
+  threadId: string,
+  userId: string,
+  attachments?: MessageAttachment[],
+  requestId: string = crypto.randomUUID()
+): AsyncGenerator<ChatEvent, void, unknown> {
+  yield* streamChatEvents(
+    "/api/chat",
+    {
+      message,
+      thread_id: threadId,
+      user_id: userId,
+      attachments: attachments || [],
+      request_id: requestId,
+    },
+    "Send message"
+  );
+}
+
 /**
  * Fork from a checkpoint (time travel) and send a message.
  * Returns an async generator that yields ChatEvent objects.
+ * Dropped connections are retried under the same requestId.
  */
 export async function* streamFork(
   message: string,
   threadId: string,
   userId: string,
   checkpointId: string,
-  attachments?: MessageAttachment[]
+  attachments?: MessageAttachment[],
+  requestId: string = crypto.randomUUID()
 ): AsyncGenerator<ChatEvent, void, unknown> {
-  const response = await fetch(`${API_BASE}/api/chat/fork`, {
-    method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({
+  yield* streamChatEvents(
+    "/api/chat/fork",
+    {
       message,
       thread_id: threadId,
       user_id: userId,
       checkpoint_id: checkpointId,
       attachments: attachments || [],
-    }),
-  });
-
-  if (!response.ok) {
-    const errorText = await response.text();
-    console.error("Fork request failed:", response.status, errorText);
-    yield { type: "error", content: `Failed to fork: ${response.status}` };
-    return;
-  }
-
-  const reader = response.body?.getReader();
-  if (!reader) {
-    yield { type: "error", content: "No response body" };
-    return;
-  }
-
-  const decoder = new TextDecoder();
-  let buffer = "";
-
-  try {
-    while (true) {
-      const { done, value } = await reader.read();
-      if (done) {
-        if (buffer.trim()) {
-          const remaining = buffer.trim();
-          if (remaining.startsWith("data: ")) {
-            try {
-              const event = JSON.parse(remaining.slice(6)) as ChatEvent;
-              yield event;
-            } catch {
-              console.error("Failed to parse remaining buffer:", remaining);
-            }
-          }
-        }
-        break;
-      }
-
-      buffer += decoder.decode(value, { stream: true });
-
-      const messages = buffer.split("\n\n");
-      buffer = messages.pop() || "";
-
-      for (const message of messages) {
-        const trimmed = message.trim();
-        if (!trimmed) continue;
-        
-        const lines = trimmed.split("\n");
-        for (const line of lines) {
-          if (line.startsWith("data: ")) {
-            const data = line.slice(6);
-            try {
-              const event = JSON.parse(data) as ChatEvent;
-              yield event;
-              if (event.type === "done" || event.type === "error") {
-                return;
-              }
-            } catch (e) {
-              console.error("Failed to parse SSE data:", data, e);
-            }
-          }
-        }
-      }
-    }
-  } finally {
-    reader.releaseLock();
-  }
+      request_id: requestId,
+    },
+    "Fork"
+  );
 }
@@ -1,27 +1,42 @@
+import asyncio
 import os
+import sys
+import time
 from typing import Literal, Any, Dict
 
+import httpx
 from deepagents import create_deep_agent
-from tavily import TavilyClient  # pip install tavily-python
 from langchain_core.messages import AIMessageChunk, ToolMessage
 from dotenv import load_dotenv
 load_dotenv()
 
-tavily = TavilyClient(api_key=os.environ["TAVILY_API_KEY"])
+# One keep-alive client for every search, so tool calls reuse the TLS connection
+# to Tavily instead of opening a new one each time
+tavily_http = httpx.AsyncClient(
+    base_url="https://api.tavily.com",
+    headers={"Authorization": f"Bearer {os.environ['TAVILY_API_KEY']}"},
+    limits=httpx.Limits(max_keepalive_connections=20),
+    timeout=60,
+)
 
-def internet_search(
+async def internet_search(
     query: str,
     max_results: int = 5,
     topic: Literal["general", "news", "finance"] = "general",
     include_raw_content: bool = False,
 ) -> Dict[str, Any]:
     """Simple web search tool for the agent."""
-    return tavily.search(
-        query,
-        max_results=max_results,
-        topic=topic,
-        include_raw_content=include_raw_content,
+    response = await tavily_http.post(
+        "/search",
+        json={
+            "query": query,
+            "max_results": max_results,
+            "topic": topic,
+            "include_raw_content": include_raw_content,
+        },
     )
+    response.raise_for_status()
+    return response.json()
 
 agent = create_deep_agent(
     model=os.getenv("GOOGLE_MODEL"),
@@ -38,27 +53,85 @@ inputs = {
     ]
 }
 
-# Stream BOTH "updates" (planning/state) and "messages" (tokens + tool calls/results)
-for mode, chunk in agent.stream(inputs, stream_mode=["updates", "messages"]):
-    if mode == "updates":
-        # This is where you can see background state changing (e.g., todo list middleware updates).
-        # Print it raw first; then you can filter keys you care about.
-        print("\n[UPDATE]", chunk)
-
-    elif mode == "messages":
-        msg, meta = chunk  # (message_or_chunk, metadata)
-        node = meta.get("langgraph_node", "unknown")
-
-        # 1) Stream final answer tokens (and any other AI text tokens)
-        if isinstance(msg, AIMessageChunk) and msg.content:
-            print(msg.content, end="", flush=True)
-
-        # 2) Stream tool results (ToolMessage)
-        elif isinstance(msg, ToolMessage):
-            print(f"\n\n[TOOL RESULT] node={node} tool={msg.name}\n{msg.content}\n")
-
-        # 3) Detect tool-call chunks (provider-dependent; often present in AIMessageChunk metadata)
-        # Many providers stream tool calls in partial chunks; best practice is to read meta + msg.additional_kwargs.
-        tool_calls = getattr(msg, "tool_calls", None) or msg.additional_kwargs.get("tool_calls") if hasattr(msg, "additional_kwargs") else None
-        if tool_calls:
-            print(f"\n[TOOL CALLS] node={node} -> {tool_calls}\n")
+# Token output is buffered and flushed at most every TOKEN_FLUSH_INTERVAL seconds
+# (or once TOKEN_FLUSH_CHARS accumulate) to avoid one write syscall per token
+TOKEN_FLUSH_INTERVAL = 0.02
+TOKEN_FLUSH_CHARS = 512
+
+token_buffer: list[str] = []
+buffered_chars = 0
+last_flush = time.monotonic()
+
+
+# Tool-call extraction dispatched on the exact message type, so the per-chunk
+# hot path does a single dict lookup instead of hasattr/getattr probing
+def _no_tool_calls(msg):
+    return None
+
+
+def _chunk_tool_calls(msg):
+    return msg.tool_calls or msg.additional_kwargs.get("tool_calls")
+
+
+_TOOL_CALL_GETTERS = {
+    AIMessageChunk: _chunk_tool_calls,
+    ToolMessage: _no_tool_calls,
+}
+
+
+def _generic_tool_calls(msg):
+    additional_kwargs = getattr(msg, "additional_kwargs", None) or {}
+    return getattr(msg, "tool_calls", None) or additional_kwargs.get("tool_calls")
+
+
+def flush_tokens():
+    global buffered_chars, last_flush
+    if token_buffer:
+        sys.stdout.write("".join(token_buffer))
+        sys.stdout.flush()
+        token_buffer.clear()
+        buffered_chars = 0
+    last_flush = time.monotonic()
+
+
+async def main():
+    global buffered_chars
+
+    try:
+        # Stream BOTH "updates" (planning/state) and "messages" (tokens + tool calls/results)
+        async for mode, chunk in agent.astream(inputs, stream_mode=["updates", "messages"]):
+            if mode == "updates":
+                flush_tokens()
+                # This is where you can see background state changing (e.g., todo list middleware updates).
+                # Print it raw first; then you can filter keys you care about.
+                print("\n[UPDATE]", chunk)
+
+            elif mode == "messages":
+                msg, meta = chunk  # (message_or_chunk, metadata)
+                node = meta.get("langgraph_node", "unknown")
+
+                # 1) Stream final answer tokens (and any other AI text tokens)
+                if isinstance(msg, AIMessageChunk) and msg.content:
+                    text = msg.content if isinstance(msg.content, str) else str(msg.content)
+                    token_buffer.append(text)
+                    buffered_chars += len(text)
+                    if buffered_chars >= TOKEN_FLUSH_CHARS or time.monotonic() - last_flush > TOKEN_FLUSH_INTERVAL:
+                        flush_tokens()
+
+                # 2) Stream tool results (ToolMessage)
+                elif isinstance(msg, ToolMessage):
+                    flush_tokens()
+                    print(f"\n\n[TOOL RESULT] node={node} tool={msg.name}\n{msg.content}\n")
+
+                # 3) Detect tool-call chunks (provider-dependent; often present in AIMessageChunk metadata)
+                # Many providers stream tool calls in partial chunks; best practice is to read meta + msg.additional_kwargs.
+                tool_calls = _TOOL_CALL_GETTERS.get(type(msg), _generic_tool_calls)(msg)
+                if tool_calls:
+                    flush_tokens()
+                    print(f"\n[TOOL CALLS] node={node} -> {tool_calls}\n")
+    finally:
+        flush_tokens()
+        await tavily_http.aclose()
+
+
+asyncio.run(main())
@@ -1,4 +1,7 @@
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
 import pymupdf
 from dotenv import load_dotenv
 
@@ -7,36 +10,63 @@ load_dotenv()
 PDF_PATH = "data/sample.pdf"
 IMAGES_DIR = "data/images"
 
-# Create images directory if it doesn't exist
-os.makedirs(IMAGES_DIR, exist_ok=True)
+# Per-worker document handle (MuPDF documents can't be shared across processes)
+_worker_docs = {}
+
+
+def write_image(image_path, image_bytes):
+    """Write extracted image bytes to disk."""
+    fd = os.open(image_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        # os.write may write fewer bytes than given; keep going until done
+        view = memoryview(image_bytes)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+    return image_path
+
+
+def process_page(pdf_path, page_num):
+    """Extract text and save images for a single page in a worker process."""
+    doc = _worker_docs.get(pdf_path)
+    if doc is None:
+        doc = _worker_docs[pdf_path] = pymupdf.open(pdf_path)
 
-# Extract text and images from the PDF
-doc = pymupdf.open(PDF_PATH)
-pages_data = []
+    # Use the document-level accessors; MuPDF isn't thread-safe, so pages are
+    # parallelized across processes rather than threads
+    text = doc.get_page_text(page_num, "text")
 
-for page_num, page in enumerate(doc):
-    # Extract text from page
-    text = page.get_text("text")
-    
     # Extract and save images
     image_paths = []
-    for img_idx, img in enumerate(page.get_images()):
+    for img_idx, img in enumerate(doc.get_page_images(page_num)):
         xref = img[0]
         base_image = doc.extract_image(xref)
         image_path = f"{IMAGES_DIR}/page{page_num}_img{img_idx}.{base_image['ext']}"
-        with open(image_path, "wb") as f:
-            f.write(base_image["image"])
-        image_paths.append(image_path)
-        print(f"Saved: {image_path}")
-    
-    pages_data.append({
+        image_paths.append(write_image(image_path, base_image["image"]))
+
+    return {
         "page_num": page_num,
         "text": text,
         "images": image_paths
-    })
+    }
+
+
+if __name__ == "__main__":
+    # Create images directory if it doesn't exist
+    os.makedirs(IMAGES_DIR, exist_ok=True)
+
+    with pymupdf.open(PDF_PATH) as doc:
+        page_count = doc.page_count
+
+    # Spread pages across worker processes; chunksize amortizes IPC per task
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        pages_data = list(executor.map(partial(process_page, PDF_PATH), range(page_count), chunksize=4))
 
-doc.close()
+    for page in pages_data:
+        for image_path in page["images"]:
+            print(f"Saved: {image_path}")
 
-print(f"\nTotal pages: {len(pages_data)}")
-for page in pages_data:
-    print(f"Page {page['page_num']}: {len(page['images'])} images, {len(page['text'])} chars")
\ No newline at end of file
+    print(f"\nTotal pages: {len(pages_data)}")
+    for page in pages_data:
+        print(f"Page {page['page_num']}: {len(page['images'])} images, {len(page['text'])} chars")
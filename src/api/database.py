@@ -4,38 +4,83 @@ Provides async PostgreSQL connection management for threads and messages.
 """
 
 import os
-from contextlib import contextmanager
-from typing import Optional
+from functools import lru_cache
+from typing import AsyncIterator, Optional
 
-import psycopg
 from dotenv import load_dotenv
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+from src.utils.checkpointer import PREPARE_THRESHOLD
 
 load_dotenv()
 
 
+# Resolved once at import time; the environment doesn't change at runtime
+_CONN_STRING = os.getenv("POSTGRES_URI")
+
+
 def get_connection_string() -> str:
     """Get PostgreSQL connection string from environment."""
-    conn_string = os.getenv("POSTGRES_URI")
-    if not conn_string:
+    if not _CONN_STRING:
         raise ValueError("POSTGRES_URI environment variable is required")
-    return conn_string
+    return _CONN_STRING
+
+
+# Connections per API worker process. Each worker also holds the
+# checkpointer pool (5-20) and the message log pool, so keep the sum times
+# the worker count below the server's max_connections
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+
+
+@lru_cache(maxsize=1)
+def get_pool() -> AsyncConnectionPool:
+    """
+    Get the shared connection pool, creating it (unopened) on first use.
+    
+    Created lazily so importing this module doesn't require POSTGRES_URI;
+    the FastAPI lifespan handler opens and closes it. Repeated queries are
+    prepared server-side per PREPARE_THRESHOLD, and hot read paths use the
+    binary result format so rows are decoded by psycopg's C layer without
+    text parsing. Rows come back as
+    dicts keyed by column name (dict_row), so queries alias their columns to
+    the API field names and results are returned directly.
+    """
+    return AsyncConnectionPool(
+        get_connection_string(),
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        kwargs={"row_factory": dict_row, "prepare_threshold": PREPARE_THRESHOLD},
+        open=False,
+    )
+
+
+# Timestamps are rendered as ISO 8601 strings (UTC) by PostgreSQL so rows can be
+# returned as-is instead of formatting datetimes in Python
+ISO_TIMESTAMP_FORMAT = 'YYYY-MM-DD"T"HH24:MI:SS.US"+00:00"'
+
+
+def _iso(column: str) -> str:
+    """SQL expression rendering a timestamptz column as an ISO 8601 string."""
+    return f"to_char({column} AT TIME ZONE 'UTC', '{ISO_TIMESTAMP_FORMAT}')"
 
 
-@contextmanager
-def get_db_connection():
-    """Context manager for database connections."""
-    conn = psycopg.connect(get_connection_string())
-    try:
-        yield conn
-    finally:
-        conn.close()
+# Arbitrary key for the advisory lock that serializes startup DDL across workers
+SETUP_LOCK_KEY = 873214
 
 
 async def setup_tables() -> None:
     """Create necessary tables if they don't exist."""
-    with get_db_connection() as conn:
-        # Create threads table for tracking conversation threads
-        conn.execute("""
+    async with get_pool().connection() as conn:
+        # Run all DDL as one batch in a single transaction. The advisory lock
+        # makes concurrent workers wait for the first one instead of racing
+        # on the catalog, and the local timeout keeps startup from hanging.
+        await conn.execute(f"""
+            SET LOCAL statement_timeout = 5000;
+            SELECT pg_advisory_xact_lock({SETUP_LOCK_KEY});
+            
+            -- Threads table for tracking conversation threads
             CREATE TABLE IF NOT EXISTS threads (
                 id TEXT PRIMARY KEY,
                 user_id TEXT NOT NULL,
@@ -46,10 +91,8 @@ async def setup_tables() -> None:
             
             CREATE INDEX IF NOT EXISTS idx_threads_user 
             ON threads(user_id, updated_at DESC);
-        """)
-        
-        # Create document_chunks table for storing processed PDF content
-        conn.execute("""
+            
+            -- Document chunks table for storing processed PDF content
             CREATE TABLE IF NOT EXISTS document_chunks (
                 id SERIAL PRIMARY KEY,
                 thread_id TEXT NOT NULL,
@@ -70,137 +113,124 @@ async def setup_tables() -> None:
             CREATE INDEX IF NOT EXISTS idx_doc_chunks_filename 
             ON document_chunks(thread_id, filename);
         """)
-        conn.commit()
+        await conn.commit()
 
 
 async def get_user_threads(user_id: str, limit: int = 50) -> list[dict]:
     """Get all threads for a user, ordered by most recent activity."""
-    with get_db_connection() as conn:
-        cursor = conn.execute(
-            """
-            SELECT id, user_id, title, created_at, updated_at
+    async with get_pool().connection() as conn:
+        cursor = await conn.execute(
+            f"""
+            SELECT id, user_id, title,
+                   {_iso("created_at")} AS created_at,
+                   {_iso("updated_at")} AS updated_at
             FROM threads
             WHERE user_id = %s
-            ORDER BY updated_at DESC
+            ORDER BY threads.updated_at DESC
             LIMIT %s
             """,
-            (user_id, limit)
+            (user_id, limit),
+            binary=True,
         )
-        rows = cursor.fetchall()
-        
-        return [
-            {
-                "id": row[0],
-                "user_id": row[1],
-                "title": row[2],
-                "created_at": row[3].isoformat() if row[3] else None,
-                "updated_at": row[4].isoformat() if row[4] else None
-            }
-            for row in rows
-        ]
+        return await cursor.fetchall()
 
 
 async def create_thread(thread_id: str, user_id: str, title: Optional[str] = None) -> dict:
     """Create a new conversation thread."""
-    with get_db_connection() as conn:
-        conn.execute(
-            """
+    async with get_pool().connection() as conn:
+        cursor = await conn.execute(
+            f"""
             INSERT INTO threads (id, user_id, title)
             VALUES (%s, %s, %s)
             ON CONFLICT (id) DO UPDATE SET updated_at = NOW()
-            RETURNING id, user_id, title, created_at, updated_at
+            RETURNING id, user_id, title,
+                      {_iso("created_at")} AS created_at,
+                      {_iso("updated_at")} AS updated_at
             """,
             (thread_id, user_id, title or "New Chat")
         )
-        conn.commit()
-        
-        # Fetch the created/updated thread
-        cursor = conn.execute(
-            "SELECT id, user_id, title, created_at, updated_at FROM threads WHERE id = %s",
-            (thread_id,)
-        )
-        row = cursor.fetchone()
-        
-        return {
-            "id": row[0],
-            "user_id": row[1],
-            "title": row[2],
-            "created_at": row[3].isoformat() if row[3] else None,
-            "updated_at": row[4].isoformat() if row[4] else None
-        }
+        thread = await cursor.fetchone()
+        await conn.commit()
+        return thread
 
 
 async def update_thread_title(thread_id: str, title: str) -> bool:
     """Update thread title (usually from first message)."""
-    with get_db_connection() as conn:
-        cursor = conn.execute(
+    async with get_pool().connection() as conn:
+        cursor = await conn.execute(
             """
             UPDATE threads SET title = %s, updated_at = NOW()
             WHERE id = %s
             """,
             (title, thread_id)
         )
-        conn.commit()
+        await conn.commit()
         return cursor.rowcount > 0
 
 
 async def delete_thread(thread_id: str) -> bool:
     """Delete a thread and its messages."""
-    with get_db_connection() as conn:
+    async with get_pool().connection() as conn:
         # Delete messages first
-        conn.execute(
+        await conn.execute(
             "DELETE FROM message_history WHERE thread_id = %s",
             (thread_id,)
         )
         # Delete thread
-        cursor = conn.execute(
+        cursor = await conn.execute(
             "DELETE FROM threads WHERE id = %s",
             (thread_id,)
         )
-        conn.commit()
+        await conn.commit()
         return cursor.rowcount > 0
 
 
-async def get_thread_messages(thread_id: str, limit: int = 100) -> list[dict]:
-    """Get messages for a specific thread, excluding internal system messages."""
-    with get_db_connection() as conn:
-        cursor = conn.execute(
-            """
-            SELECT id, thread_id, user_id, role, content, message_id, 
-                   attachments, created_at
-            FROM message_history
-            WHERE thread_id = %s
-              AND content NOT LIKE 'Gaming query: %%'
-            ORDER BY created_at ASC
-            LIMIT %s
-            """,
-            (thread_id, limit)
-        )
-        rows = cursor.fetchall()
+THREAD_MESSAGES_QUERY = f"""
+    SELECT id, thread_id, user_id, role, content, message_id, 
+           COALESCE(attachments, '[]'::jsonb) AS attachments,
+           {_iso("created_at")} AS created_at
+    FROM message_history
+    WHERE thread_id = %s
+      AND NOT is_internal
+    ORDER BY message_history.created_at ASC
+    LIMIT %s
+"""
+
+
+async def iter_thread_messages(thread_id: str, limit: int = 100) -> AsyncIterator[dict]:
+    """
+    Stream messages for a specific thread, excluding internal system messages.
+    
+    The result is capped by `limit` (at most 500 through the API), so it is
+    fetched in one round trip with a client-side cursor; the pooled connection
+    is returned before the rows are handed to the caller.
+    
+    Args:
+        thread_id: The conversation thread identifier
+        limit: Maximum number of messages to return
         
-        return [
-            {
-                "id": row[0],
-                "thread_id": row[1],
-                "user_id": row[2],
-                "role": row[3],
-                "content": row[4],
-                "message_id": row[5],
-                "attachments": row[6] if row[6] else [],
-                "created_at": row[7].isoformat() if row[7] else None
-            }
-            for row in rows
-        ]
+    Yields:
+        Message dicts in creation order
+    """
+    async with get_pool().connection() as conn:
+        cursor = await conn.execute(
+            THREAD_MESSAGES_QUERY,
+            (thread_id, limit),
+            binary=True,
+        )
+        rows = await cursor.fetchall()
+    for row in rows:
+        yield row
 
 
 async def touch_thread(thread_id: str) -> None:
     """Update thread's updated_at timestamp."""
-    with get_db_connection() as conn:
-        conn.execute(
+    async with get_pool().connection() as conn:
+        await conn.execute(
             "UPDATE threads SET updated_at = NOW() WHERE id = %s",
             (thread_id,)
         )
-        conn.commit()
+        await conn.commit()
 
 
 async def truncate_thread_messages(thread_id: str, keep_count: int) -> int:
@@ -215,15 +245,15 @@ async def truncate_thread_messages(thread_id: str, keep_count: int) -> int:
     Returns:
         Number of messages deleted
     """
-    with get_db_connection() as conn:
+    async with get_pool().connection() as conn:
         # Get IDs of messages to keep (first N messages by created_at)
         # We need to exclude internal system messages from the count to match frontend behavior
-        cursor = conn.execute(
+        cursor = await conn.execute(
             """
             WITH messages_to_keep AS (
                 SELECT id FROM message_history
                 WHERE thread_id = %s
-                  AND content NOT LIKE 'Gaming query: %%'
+                  AND NOT is_internal
                 ORDER BY created_at ASC
                 LIMIT %s
             )
@@ -234,7 +264,7 @@ async def truncate_thread_messages(thread_id: str, keep_count: int) -> int:
             (thread_id, keep_count, thread_id)
         )
         deleted_count = cursor.rowcount
-        conn.commit()
+        await conn.commit()
         return deleted_count
 
 
@@ -242,6 +272,10 @@ async def truncate_thread_messages(thread_id: str, keep_count: int) -> int:
 # Document Chunks Functions
 # =============================================================================
 
+# Batches at least this large go through COPY; smaller ones use a pipelined executemany
+COPY_MIN_CHUNKS = 200
+
+
 async def save_document_chunks(
     thread_id: str,
     user_id: str,
@@ -263,87 +297,127 @@ async def save_document_chunks(
     if not chunks:
         return 0
     
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        
-        # Insert each chunk individually (psycopg3 executemany is on cursor)
-        for chunk in chunks:
-            # Get image_keys and ensure it's a list
-            image_keys = chunk.get("image_keys", [])
-            if image_keys is None:
-                image_keys = []
+    async with get_pool().connection() as conn:
+        if len(chunks) < COPY_MIN_CHUNKS:
+            # Small batches: pipeline the upserts so they share one network flush
+            # without paying for a temporary table
+            rows = [
+                (
+                    thread_id,
+                    user_id,
+                    filename,
+                    chunk["page_num"],
+                    chunk["chunk_index"],
+                    chunk["content"],
+                    chunk.get("image_keys") or [],
+                )
+                for chunk in chunks
+            ]
+            async with conn.pipeline():
+                await conn.cursor().executemany(
+                    """
+                    INSERT INTO document_chunks 
+                        (thread_id, user_id, filename, page_num, chunk_index, content, image_keys)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s::text[])
+                    ON CONFLICT (thread_id, filename, page_num, chunk_index) 
+                    DO UPDATE SET 
+                        content = EXCLUDED.content,
+                        image_keys = EXCLUDED.image_keys,
+                        created_at = NOW()
+                    """,
+                    rows
+                )
+        else:
+            # Large batches: stream chunks into a transaction-scoped staging
+            # table with COPY, then upsert them in one statement
+            await conn.execute("""
+                CREATE TEMP TABLE document_chunks_staging (
+                    page_num INTEGER NOT NULL,
+                    chunk_index INTEGER NOT NULL,
+                    content TEXT NOT NULL,
+                    image_keys TEXT[]
+                ) ON COMMIT DROP
+            """)
+            
+            cursor = conn.cursor()
+            async with cursor.copy(
+                "COPY document_chunks_staging (page_num, chunk_index, content, image_keys) FROM STDIN"
+            ) as copy:
+                copy.set_types(["int4", "int4", "text", "text[]"])
+                for chunk in chunks:
+                    await copy.write_row((
+                        chunk["page_num"],
+                        chunk["chunk_index"],
+                        chunk["content"],
+                        chunk.get("image_keys") or [],
+                    ))
             
-            cursor.execute(
+            await conn.execute(
                 """
                 INSERT INTO document_chunks 
                     (thread_id, user_id, filename, page_num, chunk_index, content, image_keys)
-                VALUES (%s, %s, %s, %s, %s, %s, %s::text[])
+                SELECT %s, %s, %s, page_num, chunk_index, content, image_keys
+                FROM document_chunks_staging
                 ON CONFLICT (thread_id, filename, page_num, chunk_index) 
                 DO UPDATE SET 
                     content = EXCLUDED.content,
                     image_keys = EXCLUDED.image_keys,
                     created_at = NOW()
                 """,
-                (
-                    thread_id,
-                    user_id,
-                    filename,
-                    chunk["page_num"],
-                    chunk["chunk_index"],
-                    chunk["content"],
-                    image_keys,
-                )
+                (thread_id, user_id, filename)
             )
         
-        conn.commit()
+        await conn.commit()
         return len(chunks)
 
 
-async def get_document_chunks(thread_id: str, filename: Optional[str] = None) -> list[dict]:
+async def get_document_chunks(
+    thread_id: str,
+    filename: Optional[str] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+) -> list[dict]:
     """
     Get all document chunks for a thread, optionally filtered by filename.
     
     Args:
         thread_id: The conversation thread identifier
         filename: Optional filename to filter by
+        limit: Optional maximum number of chunks to return (all if not provided)
+        offset: Number of chunks to skip, for paging through large documents
         
     Returns:
         List of chunk dicts with page_num, chunk_index, content, image_keys, filename
     """
-    with get_db_connection() as conn:
+    async with get_pool().connection() as conn:
         if filename:
-            cursor = conn.execute(
+            cursor = await conn.execute(
                 """
-                SELECT filename, page_num, chunk_index, content, image_keys
+                SELECT filename, page_num, chunk_index, content,
+                       COALESCE(image_keys, '{}') AS image_keys
                 FROM document_chunks
                 WHERE thread_id = %s AND filename = %s
                 ORDER BY filename, page_num, chunk_index
+                LIMIT %s OFFSET %s
                 """,
-                (thread_id, filename)
+                (thread_id, filename, limit, offset),
+                binary=True,
             )
         else:
-            cursor = conn.execute(
+            cursor = await conn.execute(
                 """
-                SELECT filename, page_num, chunk_index, content, image_keys
+                SELECT filename, page_num, chunk_index, content,
+                       COALESCE(image_keys, '{}') AS image_keys
                 FROM document_chunks
                 WHERE thread_id = %s
                 ORDER BY filename, page_num, chunk_index
+                LIMIT %s OFFSET %s
                 """,
-                (thread_id,)
+                (thread_id, limit, offset),
+                binary=True,
             )
         
-        rows = cursor.fetchall()
-        
-        return [
-            {
-                "filename": row[0],
-                "page_num": row[1],
-                "chunk_index": row[2],
-                "content": row[3],
-                "image_keys": row[4] if row[4] else [],
-            }
-            for row in rows
-        ]
+        return await cursor.fetchall()
 
 
 async def delete_document_chunks(thread_id: str, filename: Optional[str] = None) -> int:
@@ -357,20 +431,20 @@ async def delete_document_chunks(thread_id: str, filename: Optional[str] = None)
     Returns:
         Number of chunks deleted
     """
-    with get_db_connection() as conn:
+    async with get_pool().connection() as conn:
         if filename:
-            cursor = conn.execute(
+            cursor = await conn.execute(
                 "DELETE FROM document_chunks WHERE thread_id = %s AND filename = %s",
                 (thread_id, filename)
             )
         else:
-            cursor = conn.execute(
+            cursor = await conn.execute(
                 "DELETE FROM document_chunks WHERE thread_id = %s",
                 (thread_id,)
             )
         
         deleted_count = cursor.rowcount
-        conn.commit()
+        await conn.commit()
         return deleted_count
 
 
@@ -385,22 +459,17 @@ async def get_processing_status(thread_id: str, filename: str) -> dict:
     Returns:
         Dict with processed (bool), chunk_count (int), and status info
     """
-    with get_db_connection() as conn:
-        cursor = conn.execute(
-            """
-            SELECT COUNT(*), MIN(created_at), MAX(created_at)
+    async with get_pool().connection() as conn:
+        cursor = await conn.execute(
+            f"""
+            SELECT COUNT(*) AS chunk_count,
+                   {_iso("MIN(created_at)")} AS first_processed_at,
+                   {_iso("MAX(created_at)")} AS last_processed_at
             FROM document_chunks
             WHERE thread_id = %s AND filename = %s
             """,
             (thread_id, filename)
         )
-        row = cursor.fetchone()
-        
-        chunk_count = row[0] if row else 0
-        
-        return {
-            "processed": chunk_count > 0,
-            "chunk_count": chunk_count,
-            "first_processed_at": row[1].isoformat() if row and row[1] else None,
-            "last_processed_at": row[2].isoformat() if row and row[2] else None,
-        }
+        status = await cursor.fetchone()
+        status["processed"] = status["chunk_count"] > 0
+        return status
@@ -3,31 +3,64 @@ FastAPI application for Lumos Graph chat interface.
 Provides REST API and SSE streaming for the LangGraph backend.
 """
 
+import logging
+import os
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 
-from src.api.database import setup_tables
+from src.api.database import get_connection_string, get_pool, setup_tables
 from src.api.routes import chat, files, threads
+from src.graphs.graph import builder
+from src.utils.checkpointer import open_checkpointer
+from src.utils.message_logger import MessageLogger
+
+# Module loggers (e.g. the document processors) report at LOG_LEVEL
+logging.basicConfig(
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format="%(asctime)s %(levelname)s [%(name)s] %(message)s",
+)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan handler for startup/shutdown."""
-    # Startup: ensure database tables exist
+    # Startup: open the shared connection pool and ensure database tables exist
+    await get_pool().open()
     await setup_tables()
-    yield
-    # Shutdown: cleanup if needed
+    
+    # The message queries filter on message_history's is_internal column, so
+    # its DDL must have run before any request is served
+    await chat.message_logger.setup()
+    
+    # One checkpointer and compiled graph for the whole process, backed by its
+    # own pool (the saver needs autocommit connections)
+    async with open_checkpointer(get_connection_string()) as checkpointer:
+        app.state.graph = builder.compile(checkpointer=checkpointer)
+        yield
+    
+    # Shutdown: flush queued chat messages and close the message log pools,
+    # then release the shared API pool
+    await chat.message_logger.close()
+    await MessageLogger.close_pools()
+    await get_pool().close()
 
 
 app = FastAPI(
     title="Lumos Graph API",
     description="Chat API for Lumos Graph with streaming support",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
+# Middleware must stay pure ASGI (no BaseHTTPMiddleware / @app.middleware("http")):
+# those wrap StreamingResponse bodies in a queue, which buffers the SSE streams
+# from /api/chat and /api/chat/fork and removes backpressure for slow clients.
+
 # Configure CORS for frontend
 app.add_middleware(
     CORSMiddleware,
@@ -40,6 +73,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large JSON payloads (thread lists, document chunks); SSE streams
+# (text/event-stream) and the streamed JSON arrays of the threads routes,
+# which set Content-Encoding: identity, are passed through uncompressed
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=4)
+
 # Include routers
 app.include_router(chat.router)
 app.include_router(files.router)
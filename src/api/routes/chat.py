@@ -3,19 +3,17 @@ Chat routes with SSE streaming support.
 """
 
 import asyncio
-import json
-import os
-from typing import AsyncGenerator, Optional
+from typing import AsyncGenerator, AsyncIterator, Callable, Optional
 
+import orjson
 from dotenv import load_dotenv
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from langchain_core.messages import HumanMessage, AIMessage
-from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from langgraph.graph.state import CompiledStateGraph
 from pydantic import BaseModel
 
 from src.api.database import create_thread, get_document_chunks, touch_thread, update_thread_title
-from src.graphs.graph import builder
 from src.utils.message_logger import MessageLogger
 
 load_dotenv()
@@ -26,6 +24,120 @@ router = APIRouter(prefix="/api/chat", tags=["chat"])
 message_logger = MessageLogger()
 
 
+# SSE events are sent as compact [kind, content] arrays rather than
+# {"type": ..., "content": ...} objects; the client maps kind back to a type
+TOKEN_EVENT = 0
+PROGRESS_EVENT = 1
+DONE_EVENT = 2
+ERROR_EVENT = 3
+
+
+def _sse(kind: int, content=None) -> bytes:
+    """Encode an event as an SSE data frame."""
+    event = [kind] if content is None else [kind, content]
+    return b"data: " + orjson.dumps(event) + b"\n\n"
+
+
+def _token_frame(token: str) -> bytes:
+    """Encode a token event without building an intermediate list."""
+    return b"data: [0," + orjson.dumps(token) + b"]\n\n"
+
+
+def _progress_frame(progress) -> bytes:
+    """Encode a custom-mode progress event without building an intermediate list."""
+    return b"data: [1," + orjson.dumps(progress) + b"]\n\n"
+
+
+# Frames that never change are encoded once
+DONE_FRAME = _sse(DONE_EVENT)
+
+
+# Strong references to fire-and-forget tasks so they aren't collected mid-run
+_background_tasks: set[asyncio.Task] = set()
+
+
+def _finish_background_task(task: asyncio.Task) -> None:
+    """Drop a finished background task and log its failure, if any."""
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"[chat.py] Background task failed: {task.exception()}")
+
+
+class SharedStream:
+    """
+    Runs one SSE frame generator and fans its frames out to every subscriber.
+    
+    Requests carrying the same client request id that arrive while a stream
+    is in flight (client retries of one send) join the existing run instead
+    of invoking the graph again, so each frame is produced and serialized
+    once. Late subscribers
+    first receive the frames emitted so far. A finished run stays joinable
+    for RECONNECT_GRACE seconds, and a run whose last subscriber disconnects
+    is cancelled only if nobody reconnects within that window.
+    """
+    
+    def __init__(self, key: tuple, source: AsyncIterator[bytes]):
+        self.key = key
+        self.frames: list[bytes] = []
+        self.subscribers: set[asyncio.Queue] = set()
+        self.finished = False
+        self.task = asyncio.create_task(self._run(source))
+    
+    async def _run(self, source: AsyncIterator[bytes]) -> None:
+        try:
+            async for frame in source:
+                self.frames.append(frame)
+                for queue in self.subscribers:
+                    queue.put_nowait(frame)
+        finally:
+            self.finished = True
+            for queue in self.subscribers:
+                queue.put_nowait(None)
+            # Keep the frames around so a client retrying after a dropped
+            # connection replays them instead of running the turn again
+            asyncio.get_running_loop().call_later(RECONNECT_GRACE, self._forget)
+    
+    def _forget(self) -> None:
+        if _active_streams.get(self.key) is self:
+            del _active_streams[self.key]
+    
+    def _cancel_if_abandoned(self) -> None:
+        if not self.subscribers and not self.task.done():
+            self.task.cancel()
+    
+    async def subscribe(self) -> AsyncGenerator[bytes, None]:
+        queue: asyncio.Queue = asyncio.Queue()
+        for frame in self.frames:
+            queue.put_nowait(frame)
+        if self.finished:
+            queue.put_nowait(None)
+        self.subscribers.add(queue)
+        
+        try:
+            while (frame := await queue.get()) is not None:
+                yield frame
+        finally:
+            self.subscribers.discard(queue)
+            if not self.subscribers and not self.task.done():
+                asyncio.get_running_loop().call_later(RECONNECT_GRACE, self._cancel_if_abandoned)
+
+
+# Seconds a stream waits for a client to reconnect before it is cancelled
+# (or, once finished, before its frames are dropped)
+RECONNECT_GRACE = 10.0
+
+# In-flight streams keyed by route, thread, user and client request id
+_active_streams: dict[tuple, SharedStream] = {}
+
+
+def shared_stream(key: tuple, source_factory: Callable[[], AsyncIterator[bytes]]) -> AsyncGenerator[bytes, None]:
+    """Subscribe to the in-flight stream for `key`, starting it if needed."""
+    stream = _active_streams.get(key)
+    if stream is None:
+        stream = _active_streams[key] = SharedStream(key, source_factory())
+    return stream.subscribe()
+
+
 class Attachment(BaseModel):
     """File attachment metadata."""
     filename: str
@@ -39,6 +151,7 @@ class ChatRequest(BaseModel):
     thread_id: str
     user_id: str
     attachments: list[Attachment] = []
+    request_id: Optional[str] = None  # Client id of this send; retries reuse it to join the running stream
 
 
 class ForkRequest(BaseModel):
@@ -48,9 +161,86 @@ class ForkRequest(BaseModel):
     user_id: str
     checkpoint_id: str  # The checkpoint to fork from
     attachments: list[Attachment] = []  # Attachments to include with the forked message
+    request_id: Optional[str] = None  # Client id of this send; retries reuse it to join the running stream
+
+
+async def _stream_from_config(
+    graph: CompiledStateGraph,
+    input_state: dict,
+    config: dict,
+    thread_id: str
+) -> AsyncGenerator[bytes, None]:
+    """
+    Run the graph and encode its output as SSE frames.
+    
+    Shared by the chat and fork paths. Uses astream with "updates" mode to
+    capture node outputs reliably and "custom" mode for progress events.
+    
+    Args:
+        graph: Compiled graph with the shared checkpointer
+        input_state: Graph input for this turn
+        config: Run config (thread_id, user_id and optionally checkpoint_id)
+        thread_id: Thread whose timestamp is touched on completion
+    """
+    # Track fingerprints of sent message contents to avoid duplicates
+    sent_hashes: set[int] = set()
+    
+    # Stream with BOTH "updates" and "custom" modes to capture custom stream writer events
+    async for stream_mode, chunk in graph.astream(
+        input_state, 
+        config, 
+        stream_mode=["updates", "custom"]
+    ):
+        # Handle custom stream writer events (Progress messages from nodes)
+        if stream_mode == "custom":
+            # chunk is the dict passed to writer(), e.g. {"Progress": "..."}
+            yield _progress_frame(chunk)
+            continue
+        
+        # Handle node updates
+        if stream_mode == "updates":
+            # chunk is a dict: {node_name: node_output}
+            for node_name, node_output in chunk.items():
+                if not isinstance(node_output, dict):
+                    continue
+                
+                # Check for messages in the node output
+                messages = node_output.get("messages", [])
+                for msg in messages:
+                    # Check if it's an AI message
+                    is_ai = (
+                        isinstance(msg, AIMessage) or 
+                        (hasattr(msg, "type") and msg.type == "ai")
+                    )
+                    if not is_ai:
+                        continue
+                    
+                    content = msg.content if hasattr(msg, "content") else str(msg)
+                    
+                    # Only send if we haven't sent this exact content
+                    if not content:
+                        continue
+                    content_hash = hash(content)
+                    if content_hash in sent_hashes:
+                        continue
+                    sent_hashes.add(content_hash)
+                    
+                    # Node updates carry whole messages, so send each in one frame
+                    yield _token_frame(content)
+    
+    # Update the thread timestamp concurrently with signalling completion, so
+    # the client doesn't wait on the round-trip for its last frame. The task is
+    # tracked outside the generator since clients disconnect after "done".
+    touch_task = asyncio.create_task(touch_thread(thread_id))
+    _background_tasks.add(touch_task)
+    touch_task.add_done_callback(_finish_background_task)
+    
+    # Signal completion
+    yield DONE_FRAME
 
 
 async def stream_graph_response(
+    graph: CompiledStateGraph,
     message: str,
     thread_id: str,
     user_id: str,
@@ -58,12 +248,13 @@ async def stream_graph_response(
 ) -> AsyncGenerator[bytes, None]:
     """
     Stream the graph response using SSE.
-    Uses astream with updates mode to capture node outputs reliably.
-    Preserves cached_images from previous state to avoid re-fetching from S3.
+    Uses the process-wide compiled graph (shared checkpointer pool).
+    cached_images carries over from the checkpointed state to avoid re-fetching from S3.
     """
-    # Log the user message with attachments BEFORE invoking the graph
-    # This ensures attachments are stored and we don't duplicate in ConvoNode
-    await message_logger.log_message(
+    # Queue the user message with attachments BEFORE invoking the graph
+    # This ensures attachments are stored and we don't duplicate in ConvoNode;
+    # the background writer keeps the insert off the time-to-first-byte path
+    message_logger.enqueue_message(
         thread_id=thread_id,
         user_id=user_id,
         role="human",
@@ -71,104 +262,35 @@ async def stream_graph_response(
         attachments=attachments or []
     )
     
-    # Get PostgreSQL connection string for checkpointer
-    postgres_uri = os.getenv("POSTGRES_URI")
-    if not postgres_uri:
-        yield f"data: {json.dumps({'type': 'error', 'content': 'Database not configured'})}\n\n".encode()
-        return
-    
     try:
-        # Compile graph with async PostgreSQL checkpointer
-        async with AsyncPostgresSaver.from_conn_string(postgres_uri) as checkpointer:
-            await checkpointer.setup()
-            
-            graph = builder.compile(checkpointer=checkpointer)
-            
-            config = {
-                "configurable": {
-                    "thread_id": thread_id,
-                    "user_id": user_id,
-                }
+        config = {
+            "configurable": {
+                "thread_id": thread_id,
+                "user_id": user_id,
             }
-            
-            # Fetch document context for this thread
-            doc_chunks = await get_document_chunks(thread_id)
-            
-            # Get current state to retrieve cached images (if any exist from previous invocations)
-            current_state = await graph.aget_state(config)
-            cached_images = None
-            if current_state and current_state.values:
-                cached_images = current_state.values.get("cached_images")
-                if cached_images:
-                    print(f"[chat.py] Found cached images for thread {thread_id}, will reuse")
-            
-            # Create input with user message, document context, and cached images
-            input_state = {
-                "messages": [HumanMessage(content=message)],
-                "document_context": doc_chunks if doc_chunks else None,
-                "cached_images": cached_images,  # Pass through cached images
-            }
-            
-            # Track sent message contents to avoid duplicates
-            sent_contents = set()
-            
-            # Stream with BOTH "updates" and "custom" modes to capture custom stream writer events
-            async for stream_mode, chunk in graph.astream(
-                input_state, 
-                config, 
-                stream_mode=["updates", "custom"]
-            ):
-                # Handle custom stream writer events (Progress messages from nodes)
-                if stream_mode == "custom":
-                    # chunk is the dict passed to writer(), e.g. {"Progress": "..."}
-                    event_data = json.dumps({'type': 'progress', 'content': chunk})
-                    yield f"data: {event_data}\n\n".encode()
-                    continue
-                
-                # Handle node updates (existing logic)
-                if stream_mode == "updates":
-                    # chunk is a dict: {node_name: node_output}
-                    for node_name, node_output in chunk.items():
-                        if not isinstance(node_output, dict):
-                            continue
-                        
-                        # Check for messages in the node output
-                        messages = node_output.get("messages", [])
-                        for msg in messages:
-                            # Check if it's an AI message
-                            is_ai = (
-                                isinstance(msg, AIMessage) or 
-                                (hasattr(msg, "type") and msg.type == "ai")
-                            )
-                            if is_ai:
-                                content = msg.content if hasattr(msg, "content") else str(msg)
-                                
-                                # Only send if we haven't sent this exact content
-                                if content and content not in sent_contents:
-                                    sent_contents.add(content)
-                                    # Simulate streaming by sending in chunks with small delay
-                                    words = content.split(" ")
-                                    for i, word in enumerate(words):
-                                        token = word if i == len(words) - 1 else word + " "
-                                        event_data = json.dumps({'type': 'token', 'content': token})
-                                        yield f"data: {event_data}\n\n".encode()
-                                        # Small delay for visual streaming effect
-                                        await asyncio.sleep(0.02)
-            
-            # Update thread timestamp
-            await touch_thread(thread_id)
-            
-            # Signal completion
-            yield f"data: {json.dumps({'type': 'done'})}\n\n".encode()
-            
+        }
+        
+        # Fetch document context for this thread
+        doc_chunks = await get_document_chunks(thread_id)
+        
+        # Create input with user message and document context. cached_images is
+        # left out so the channel keeps its checkpointed value for ConvoNode
+        input_state = {
+            "messages": [HumanMessage(content=message)],
+            "document_context": doc_chunks if doc_chunks else None,
+        }
+        
+        async for frame in _stream_from_config(graph, input_state, config, thread_id):
+            yield frame
+        
     except Exception as e:
         import traceback
         print(f"Chat error: {str(e)}\n{traceback.format_exc()}")
-        yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n".encode()
+        yield _sse(ERROR_EVENT, str(e))
 
 
 @router.post("")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, http_request: Request):
     """
     Send a message and receive a streaming response via SSE.
     """
@@ -185,13 +307,24 @@ async def chat(request: ChatRequest):
     # Convert attachments to dict format for logging
     attachments_data = [att.model_dump() for att in request.attachments] if request.attachments else None
     
-    return StreamingResponse(
-        stream_graph_response(
+    def source() -> AsyncGenerator[bytes, None]:
+        return stream_graph_response(
+            graph=http_request.app.state.graph,
             message=request.message,
             thread_id=request.thread_id,
             user_id=request.user_id,
             attachments=attachments_data
-        ),
+        )
+    
+    # Only a retry of the same send (same request id) joins a running stream;
+    # re-sending the same text is a new turn
+    if request.request_id:
+        frames = shared_stream(("chat", request.thread_id, request.user_id, request.request_id), source)
+    else:
+        frames = source()
+    
+    return StreamingResponse(
+        frames,
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -202,6 +335,7 @@ async def chat(request: ChatRequest):
 
 
 async def stream_fork_response(
+    graph: CompiledStateGraph,
     message: str,
     thread_id: str,
     user_id: str,
@@ -211,10 +345,10 @@ async def stream_fork_response(
     """
     Fork from a specific checkpoint and stream the response.
     This implements time travel by continuing from a past state.
-    Preserves cached_images from the checkpoint state.
+    cached_images carries over from the checkpoint state.
     """
-    # Log the user message with attachments BEFORE invoking the graph
-    await message_logger.log_message(
+    # Queue the user message with attachments BEFORE invoking the graph
+    message_logger.enqueue_message(
         thread_id=thread_id,
         user_id=user_id,
         role="human",
@@ -222,94 +356,37 @@ async def stream_fork_response(
         attachments=attachments or []
     )
     
-    postgres_uri = os.getenv("POSTGRES_URI")
-    if not postgres_uri:
-        yield f"data: {json.dumps({'type': 'error', 'content': 'Database not configured'})}\n\n".encode()
-        return
-    
     try:
-        async with AsyncPostgresSaver.from_conn_string(postgres_uri) as checkpointer:
-            await checkpointer.setup()
-            
-            graph = builder.compile(checkpointer=checkpointer)
-            
-            # Config with specific checkpoint_id to fork from
-            config = {
-                "configurable": {
-                    "thread_id": thread_id,
-                    "user_id": user_id,
-                    "checkpoint_id": checkpoint_id,  # This tells LangGraph to start from this checkpoint
-                }
+        # Config with specific checkpoint_id to fork from
+        config = {
+            "configurable": {
+                "thread_id": thread_id,
+                "user_id": user_id,
+                "checkpoint_id": checkpoint_id,  # This tells LangGraph to start from this checkpoint
             }
-            
-            # Fetch document context for this thread
-            doc_chunks = await get_document_chunks(thread_id)
-            
-            # Get state from the checkpoint to retrieve cached images
-            checkpoint_state = await graph.aget_state(config)
-            cached_images = None
-            if checkpoint_state and checkpoint_state.values:
-                cached_images = checkpoint_state.values.get("cached_images")
-                if cached_images:
-                    print(f"[chat.py] Found cached images in checkpoint {checkpoint_id}, will reuse")
-            
-            # Create input with user message, document context, and cached images
-            input_state = {
-                "messages": [HumanMessage(content=message)],
-                "document_context": doc_chunks if doc_chunks else None,
-                "cached_images": cached_images,  # Pass through cached images from checkpoint
-            }
-            
-            # Track sent message contents to avoid duplicates
-            sent_contents = set()
-            
-            # Stream with BOTH "updates" and "custom" modes
-            async for stream_mode, chunk in graph.astream(
-                input_state, 
-                config, 
-                stream_mode=["updates", "custom"]
-            ):
-                # Handle custom stream writer events (Progress messages from nodes)
-                if stream_mode == "custom":
-                    event_data = json.dumps({'type': 'progress', 'content': chunk})
-                    yield f"data: {event_data}\n\n".encode()
-                    continue
-                
-                # Handle node updates
-                if stream_mode == "updates":
-                    for node_name, node_output in chunk.items():
-                        if not isinstance(node_output, dict):
-                            continue
-                        
-                        messages = node_output.get("messages", [])
-                        for msg in messages:
-                            is_ai = (
-                                isinstance(msg, AIMessage) or 
-                                (hasattr(msg, "type") and msg.type == "ai")
-                            )
-                            if is_ai:
-                                content = msg.content if hasattr(msg, "content") else str(msg)
-                                
-                                if content and content not in sent_contents:
-                                    sent_contents.add(content)
-                                    words = content.split(" ")
-                                    for i, word in enumerate(words):
-                                        token = word if i == len(words) - 1 else word + " "
-                                        event_data = json.dumps({'type': 'token', 'content': token})
-                                        yield f"data: {event_data}\n\n".encode()
-                                        await asyncio.sleep(0.02)
-            
-            await touch_thread(thread_id)
-            yield f"data: {json.dumps({'type': 'done'})}\n\n".encode()
-            
+        }
+        
+        # Fetch document context for this thread
+        doc_chunks = await get_document_chunks(thread_id)
+        
+        # Create input with user message and document context; ConvoNode reads
+        # cached_images straight from the forked checkpoint's state
+        input_state = {
+            "messages": [HumanMessage(content=message)],
+            "document_context": doc_chunks if doc_chunks else None,
+        }
+        
+        async for frame in _stream_from_config(graph, input_state, config, thread_id):
+            yield frame
+        
     except Exception as e:
         import traceback
         print(f"Fork error: {str(e)}\n{traceback.format_exc()}")
-        yield f"data: {json.dumps({'type': 'error', 'content': str(e)})}\n\n".encode()
+        yield _sse(ERROR_EVENT, str(e))
 
 
 @router.post("/fork")
-async def fork_from_checkpoint(request: ForkRequest):
+async def fork_from_checkpoint(request: ForkRequest, http_request: Request):
     """
     Fork from a specific checkpoint (time travel) and send a new message.
     This allows users to go back to a previous state and explore an alternate path.
@@ -323,14 +400,23 @@ async def fork_from_checkpoint(request: ForkRequest):
     # Convert attachments to dict format for logging
     attachments_data = [att.model_dump() for att in request.attachments] if request.attachments else None
     
-    return StreamingResponse(
-        stream_fork_response(
+    def source() -> AsyncGenerator[bytes, None]:
+        return stream_fork_response(
+            graph=http_request.app.state.graph,
             message=request.message,
             thread_id=request.thread_id,
             user_id=request.user_id,
             checkpoint_id=request.checkpoint_id,
             attachments=attachments_data
-        ),
+        )
+    
+    if request.request_id:
+        frames = shared_stream(("fork", request.thread_id, request.user_id, request.request_id), source)
+    else:
+        frames = source()
+    
+    return StreamingResponse(
+        frames,
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
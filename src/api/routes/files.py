@@ -4,20 +4,34 @@ Supports PDF and PPTX file uploads with user/thread organization.
 Includes background processing for text extraction and chunking.
 """
 
+import asyncio
+import logging
+from typing import AsyncIterator
+
 from fastapi import APIRouter, BackgroundTasks, File, Form, HTTPException, UploadFile
-from fastapi.responses import Response, StreamingResponse
+from fastapi.responses import RedirectResponse, StreamingResponse
 from pydantic import BaseModel
 
 from src.api.database import delete_document_chunks, get_processing_status
 from src.utils.pdf_processor import process_uploaded_file
 from src.utils.pptx_processor import process_uploaded_pptx_file
-from src.utils.s3_operations import S3Operations, ALLOWED_FILE_TYPES
+from src.utils.s3_operations import S3Operations, ALLOWED_FILE_TYPES, get_s3_ops
 
 # PPTX content type for detection
 PPTX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.presentationml.presentation"
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/api/files", tags=["files"])
 
+# Upload validation lookups, built once
+ALLOWED_EXT: frozenset[str] = frozenset(ALLOWED_FILE_TYPES)
+_ALLOWED_EXT_MSG = ", ".join(ALLOWED_FILE_TYPES)
+
+# Bound concurrent S3 uploads per process to stay clear of S3 rate limits
+UPLOAD_CONCURRENCY = 8
+_upload_semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
 
 class FileUploadResponse(BaseModel):
     """Response model for file upload."""
@@ -61,6 +75,29 @@ class MultiUploadResponse(BaseModel):
     processing_triggered: int = 0  # Number of files queued for background processing
 
 
+class PresignUploadRequest(BaseModel):
+    """Request for a presigned direct-to-S3 upload URL."""
+    filename: str
+    user_id: str
+    thread_id: str
+
+
+class PresignUploadResponse(BaseModel):
+    """Presigned PUT URL; the client must send content_type as Content-Type."""
+    url: str
+    key: str
+    content_type: str
+    expires_in: int
+
+
+class RegisterUploadRequest(BaseModel):
+    """Metadata for a file the client has uploaded directly to S3."""
+    filename: str
+    user_id: str
+    thread_id: str
+    size: int | None = None
+
+
 class FileProcessingStatus(BaseModel):
     """Response model for file processing status."""
     filename: str
@@ -71,9 +108,9 @@ class FileProcessingStatus(BaseModel):
 
 
 def _get_s3_ops() -> S3Operations:
-    """Get S3Operations instance. Raises HTTPException if not configured."""
+    """Get the shared S3Operations instance. Raises HTTPException if not configured."""
     try:
-        return S3Operations()
+        return get_s3_ops()
     except ValueError as e:
         raise HTTPException(
             status_code=500,
@@ -81,6 +118,81 @@ def _get_s3_ops() -> S3Operations:
         )
 
 
+def _schedule_processing(
+    background_tasks: BackgroundTasks,
+    content_type: str,
+    key: str,
+    user_id: str,
+    thread_id: str,
+    filename: str,
+) -> bool:
+    """Queue background text/image extraction for PDF and PPTX files."""
+    if content_type == "application/pdf":
+        background_tasks.add_task(process_uploaded_file, key, user_id, thread_id, filename)
+        return True
+    if content_type == PPTX_CONTENT_TYPE:
+        background_tasks.add_task(process_uploaded_pptx_file, key, user_id, thread_id, filename)
+        return True
+    return False
+
+
+@router.post("/presign", response_model=PresignUploadResponse)
+async def presign_upload(request: PresignUploadRequest):
+    """
+    Get a presigned PUT URL so the client can upload a file directly to S3.
+    
+    After the PUT succeeds, call /register to queue the file for processing.
+    """
+    s3_ops = _get_s3_ops()
+    expiration = 900
+    
+    try:
+        presigned = await s3_ops.get_presigned_upload_url(
+            request.filename, request.user_id, request.thread_id, expiration
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to generate upload URL: {str(e)}")
+    
+    return PresignUploadResponse(**presigned, expires_in=expiration)
+
+
+@router.post("/register", response_model=UploadResult)
+async def register_upload(request: RegisterUploadRequest, background_tasks: BackgroundTasks):
+    """
+    Register a file uploaded through a presigned URL and queue it for processing.
+    """
+    s3_ops = _get_s3_ops()
+    
+    if not s3_ops._validate_file_type(request.filename):
+        raise HTTPException(
+            status_code=400,
+            detail=f"File '{request.filename}' has invalid type. Allowed: {_ALLOWED_EXT_MSG}"
+        )
+    
+    # The browser uploaded straight to S3, so skip any cached answer
+    exists = await s3_ops.file_exists(
+        request.filename, request.user_id, request.thread_id, use_cache=False
+    )
+    if not exists:
+        raise HTTPException(status_code=404, detail="File not found")
+    
+    key = s3_ops._build_s3_key(request.user_id, request.thread_id, request.filename)
+    content_type = s3_ops._get_content_type(request.filename)
+    _schedule_processing(
+        background_tasks, content_type, key, request.user_id, request.thread_id, request.filename
+    )
+    
+    return UploadResult(
+        filename=request.filename,
+        key=key,
+        bucket=s3_ops.bucket_name,
+        size=request.size,
+        content_type=content_type,
+    )
+
+
 @router.post("/upload", response_model=MultiUploadResponse)
 async def upload_files(
     background_tasks: BackgroundTasks,
@@ -91,6 +203,9 @@ async def upload_files(
     """
     Upload one or more files (PDF or PPTX) to S3.
     
+    Deprecated in favor of /presign + /register, which keep file bytes off
+    the API server. Kept as a fallback for clients that can't reach S3.
+    
     Files are stored at: {prefix}/{user_id}/{thread_id}/{filename}
     PDF and PPTX files are automatically queued for background processing to extract
     text and images for use as conversation context.
@@ -99,73 +214,53 @@ async def upload_files(
         raise HTTPException(status_code=400, detail="No files provided")
     
     # Validate file types
-    allowed_extensions = list(ALLOWED_FILE_TYPES.keys())
     for file in files:
         if not file.filename:
             raise HTTPException(status_code=400, detail="File must have a filename")
         
         ext = "." + file.filename.rsplit(".", 1)[-1].lower() if "." in file.filename else ""
-        if ext not in allowed_extensions:
+        if ext not in ALLOWED_EXT:
             raise HTTPException(
                 status_code=400,
-                detail=f"File '{file.filename}' has invalid type. Allowed: {', '.join(allowed_extensions)}"
+                detail=f"File '{file.filename}' has invalid type. Allowed: {_ALLOWED_EXT_MSG}"
             )
     
     s3_ops = _get_s3_ops()
     
-    # Read file contents and prepare for upload
-    files_to_upload = []
-    for file in files:
-        content = await file.read()
-        files_to_upload.append((content, file.filename))
-    
-    # Upload all files
-    results = await s3_ops.upload_files(files_to_upload, user_id, thread_id)
+    async def _handle_one(file: UploadFile) -> tuple[UploadResult, bool]:
+        """Upload one file and queue its processing; returns (result, queued)."""
+        async with _upload_semaphore:
+            try:
+                # Stream the spooled upload to S3 in parts rather than reading
+                # it into memory first
+                result = await s3_ops.upload_file(file.file, file.filename, user_id, thread_id)
+            except Exception as e:
+                return UploadResult(filename=file.filename, error=str(e)), False
+        
+        queued = _schedule_processing(
+            background_tasks,
+            result["content_type"],
+            result["key"],
+            user_id,
+            thread_id,
+            result["filename"],
+        )
+        return UploadResult(
+            filename=result["filename"],
+            key=result["key"],
+            bucket=result["bucket"],
+            size=result["size"],
+            content_type=result["content_type"],
+        ), queued
     
-    # Format response
-    upload_results = []
-    success_count = 0
-    error_count = 0
-    processing_triggered = 0
+    # Run the per-file pipelines concurrently so total time is the slowest
+    # file rather than the sum
+    outcomes = await asyncio.gather(*map(_handle_one, files))
     
-    for result in results:
-        if "error" in result:
-            error_count += 1
-            upload_results.append(UploadResult(
-                filename=result["filename"],
-                error=result["error"],
-            ))
-        else:
-            success_count += 1
-            upload_results.append(UploadResult(
-                filename=result["filename"],
-                key=result["key"],
-                bucket=result["bucket"],
-                size=result["size"],
-                content_type=result["content_type"],
-            ))
-            
-            # Trigger background processing for PDF files
-            if result.get("content_type") == "application/pdf":
-                background_tasks.add_task(
-                    process_uploaded_file,
-                    result["key"],
-                    user_id,
-                    thread_id,
-                    result["filename"],
-                )
-                processing_triggered += 1
-            
-            # Trigger background processing for PPTX files
-            elif result.get("content_type") == PPTX_CONTENT_TYPE:
-                background_tasks.add_task(
-                    process_uploaded_pptx_file,
-                    result["key"],
-                    user_id,
-                    thread_id,
-                    result["filename"],
-                )
-                processing_triggered += 1
+    upload_results = [result for result, _ in outcomes]
+    error_count = sum(1 for result in upload_results if result.error)
+    success_count = len(upload_results) - error_count
+    processing_triggered = sum(1 for _, queued in outcomes if queued)
     
     return MultiUploadResponse(
         uploaded=upload_results,
@@ -190,11 +285,13 @@ async def list_files(user_id: str, thread_id: str):
 
 
 @router.get("/{user_id}/{thread_id}/{filename}")
-async def download_file(user_id: str, thread_id: str, filename: str):
+async def download_file(user_id: str, thread_id: str, filename: str, proxy: bool = False):
     """
     Download a specific file.
     
-    Returns the file content with appropriate content type.
+    Redirects to a short-lived presigned URL so S3 serves the bytes directly.
+    Pass ?proxy=1 to stream the file through the API instead, for environments
+    without public S3 egress.
     """
     s3_ops = _get_s3_ops()
     
@@ -203,19 +300,42 @@ async def download_file(user_id: str, thread_id: str, filename: str):
     if not exists:
         raise HTTPException(status_code=404, detail="File not found")
     
+    if not proxy:
+        # S3 sets the same attachment headers the proxied response does, so
+        # browsers still download the file under its name
+        try:
+            url = await s3_ops.get_presigned_url(filename, user_id, thread_id, 300, attachment=True)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to generate URL: {str(e)}")
+        return RedirectResponse(url=url, status_code=307)
+    
+    # Stream the object through in chunks so memory stays constant and the
+    # first bytes go out as soon as S3 sends them. The first chunk is read
+    # up front so a failing GET still becomes a 500
+    chunks = s3_ops.iter_file_chunks(filename, user_id, thread_id)
     try:
-        content = await s3_ops.download_file(filename, user_id, thread_id)
-        content_type = s3_ops._get_content_type(filename)
-        
-        return Response(
-            content=content,
-            media_type=content_type,
-            headers={
-                "Content-Disposition": f'attachment; filename="{filename}"'
-            }
-        )
+        first = await anext(chunks, b"")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to download file: {str(e)}")
+    
+    async def body() -> AsyncIterator[bytes]:
+        yield first
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except Exception:
+            # Headers are already sent; log and let the connection abort so
+            # the client sees a failed download rather than a short file
+            logger.exception("Failed while streaming %s", filename)
+            raise
+    
+    return StreamingResponse(
+        body(),
+        media_type=s3_ops._get_content_type(filename),
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"'
+        }
+    )
 
 
 @router.get("/{user_id}/{thread_id}/{filename}/url")
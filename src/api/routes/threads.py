@@ -2,29 +2,85 @@
 Thread management routes for conversation history.
 """
 
-import os
-from typing import Optional, List, Any
+import logging
+from typing import AsyncIterator, Optional, List, Any
 from uuid import uuid4
 
 from dotenv import load_dotenv
-from fastapi import APIRouter, HTTPException, Query
+import orjson
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
-from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
 
 from src.api.database import (
     get_user_threads,
     create_thread,
     delete_thread,
-    get_thread_messages,
+    iter_thread_messages,
     update_thread_title,
     truncate_thread_messages,
 )
-from src.graphs.graph import builder
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter(prefix="/api/threads", tags=["threads"])
 
+# Number of rows encoded per chunk when streaming JSON arrays
+STREAM_BATCH_ROWS = 100
+
+# Marks streamed responses as already encoded so GZipMiddleware passes their
+# chunks straight through instead of buffering them in its compressor
+STREAM_HEADERS = {"Content-Encoding": "identity"}
+
+
+async def _prefetch(rows: AsyncIterator[dict]) -> AsyncIterator[dict]:
+    """
+    Fetch the first row before a streaming response is started.
+    
+    Query failures then raise while an error status can still be returned,
+    instead of after the 200 headers have gone out.
+    
+    Args:
+        rows: Row iterator to stream
+        
+    Returns:
+        An iterator yielding the same rows, the first one already fetched
+    """
+    first = await anext(rows, None)
+    
+    async def _rows() -> AsyncIterator[dict]:
+        if first is None:
+            return
+        yield first
+        async for row in rows:
+            yield row
+    
+    return _rows()
+
+
+async def _stream_json_array(rows: AsyncIterator[dict]) -> AsyncIterator[bytes]:
+    """Encode rows as a JSON array incrementally, a batch of rows per chunk."""
+    yield b"["
+    batch = []
+    first = True
+    try:
+        async for row in rows:
+            batch.append(orjson.dumps(row))
+            if len(batch) >= STREAM_BATCH_ROWS:
+                yield (b"" if first else b",") + b",".join(batch)
+                first = False
+                batch = []
+    except Exception:
+        # Headers are already sent; end the body without closing the array
+        # so the client's JSON parse fails instead of accepting a truncated list
+        logger.exception("Failed while streaming JSON rows")
+        return
+    if batch:
+        yield (b"" if first else b",") + b",".join(batch)
+    yield b"]"
+
 
 class CreateThreadRequest(BaseModel):
     user_id: str
@@ -91,7 +147,9 @@ async def list_threads(
 ):
     """List all conversation threads for a user."""
     threads = await get_user_threads(user_id, limit)
-    return threads
+    # Rows come from our own query in the ThreadResponse shape; returning the
+    # response directly skips re-validating them against response_model
+    return ORJSONResponse(threads)
 
 
 @router.post("", response_model=ThreadResponse)
@@ -107,9 +165,20 @@ async def get_messages(
     thread_id: str,
     limit: int = Query(100, ge=1, le=500)
 ):
-    """Get all messages for a specific thread."""
-    messages = await get_thread_messages(thread_id, limit)
-    return messages
+    """
+    Get all messages for a specific thread.
+    Rows are encoded straight into a streamed JSON response; they come from
+    our own query in the MessageResponse shape, so response_model only
+    documents them.
+    """
+    # Run the query up front so failures still surface as a 500
+    try:
+        rows = await _prefetch(iter_thread_messages(thread_id, limit))
+    except Exception as e:
+        logger.exception("Messages error for thread %s", thread_id)
+        raise HTTPException(status_code=500, detail=f"Failed to get messages: {str(e)}")
+    
+    return StreamingResponse(_stream_json_array(rows), media_type="application/json", headers=STREAM_HEADERS)
 
 
 @router.patch("/{thread_id}")
@@ -143,66 +212,62 @@ async def truncate_messages(thread_id: str, request: TruncateMessagesRequest):
     return {"status": "truncated", "deleted_count": deleted_count}
 
 
+async def _iter_checkpoints(graph, thread_id: str, limit: int) -> AsyncIterator[dict]:
+    """Yield checkpoint history entries, newest first, as they are fetched."""
+    config = {"configurable": {"thread_id": thread_id}}
+    
+    step = 0
+    
+    # Iterate through state history; the checkpointer applies limit in SQL
+    async for state_snapshot in graph.aget_state_history(config, limit=limit):
+        # Extract messages from state
+        messages = []
+        state_values = state_snapshot.values
+        if state_values and "messages" in state_values:
+            # The messages channel only holds BaseMessage objects
+            messages = [
+                {"role": msg.type, "content": msg.content}
+                for msg in state_values["messages"]
+            ]
+        
+        # Build the checkpoint entry as a plain dict (shape of CheckpointResponse);
+        # it goes straight to orjson without model validation
+        checkpoint_config = state_snapshot.config.get("configurable", {})
+        parent_config = state_snapshot.parent_config
+        parent_checkpoint_id = None
+        if parent_config:
+            parent_checkpoint_id = parent_config.get("configurable", {}).get("checkpoint_id")
+        
+        yield {
+            "checkpoint_id": checkpoint_config.get("checkpoint_id", ""),
+            "thread_id": checkpoint_config.get("thread_id", thread_id),
+            "checkpoint_ns": checkpoint_config.get("checkpoint_ns", ""),
+            "parent_checkpoint_id": parent_checkpoint_id,
+            "created_at": state_snapshot.metadata.get("created_at") if state_snapshot.metadata else None,
+            "step": step,
+            "messages": messages,
+        }
+        step += 1
+
+
 @router.get("/{thread_id}/history", response_model=List[CheckpointResponse])
 async def get_thread_history(
+    request: Request,
     thread_id: str,
     limit: int = Query(50, ge=1, le=100, description="Maximum number of checkpoints to return")
 ):
     """
     Get the checkpoint history for a thread (time travel).
     Returns a list of checkpoints with their states, ordered from newest to oldest.
+    Reads through the process-wide compiled graph and its pooled checkpointer;
+    each checkpoint is encoded and sent as soon as it is fetched.
     """
-    postgres_uri = os.getenv("POSTGRES_URI")
-    if not postgres_uri:
-        raise HTTPException(status_code=500, detail="Database not configured")
-    
+    # Fetch the first checkpoint up front so lookup failures still surface
+    # as a 500 rather than a truncated stream
     try:
-        async with AsyncPostgresSaver.from_conn_string(postgres_uri) as checkpointer:
-            await checkpointer.setup()
-            
-            graph = builder.compile(checkpointer=checkpointer)
-            
-            config = {"configurable": {"thread_id": thread_id}}
-            
-            checkpoints = []
-            step = 0
-            
-            # Iterate through state history
-            async for state_snapshot in graph.aget_state_history(config):
-                if step >= limit:
-                    break
-                
-                # Extract messages from state
-                messages = []
-                state_values = state_snapshot.values
-                if state_values and "messages" in state_values:
-                    for msg in state_values["messages"]:
-                        role = getattr(msg, "type", "unknown")
-                        content = getattr(msg, "content", str(msg))
-                        messages.append(CheckpointMessage(role=role, content=content))
-                
-                # Build checkpoint response
-                checkpoint_config = state_snapshot.config.get("configurable", {})
-                parent_config = state_snapshot.parent_config
-                parent_checkpoint_id = None
-                if parent_config:
-                    parent_checkpoint_id = parent_config.get("configurable", {}).get("checkpoint_id")
-                
-                checkpoint = CheckpointResponse(
-                    checkpoint_id=checkpoint_config.get("checkpoint_id", ""),
-                    thread_id=checkpoint_config.get("thread_id", thread_id),
-                    checkpoint_ns=checkpoint_config.get("checkpoint_ns", ""),
-                    parent_checkpoint_id=parent_checkpoint_id,
-                    created_at=state_snapshot.metadata.get("created_at") if state_snapshot.metadata else None,
-                    step=step,
-                    messages=messages
-                )
-                checkpoints.append(checkpoint)
-                step += 1
-            
-            return checkpoints
-            
+        checkpoints = await _prefetch(_iter_checkpoints(request.app.state.graph, thread_id, limit))
     except Exception as e:
-        import traceback
-        print(f"History error: {str(e)}\n{traceback.format_exc()}")
+        logger.exception("History error for thread %s", thread_id)
         raise HTTPException(status_code=500, detail=f"Failed to get history: {str(e)}")
+    
+    return StreamingResponse(_stream_json_array(checkpoints), media_type="application/json", headers=STREAM_HEADERS)
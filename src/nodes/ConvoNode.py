@@ -1,20 +1,19 @@
 import os
 from dotenv import load_dotenv
-import asyncio
 
 # Support both LangGraph Studio (relative imports) and FastAPI server (src-prefixed imports)
 try:
     from state.state import MainGraphState
     from schemas.ConvoAgentSchema import ConvoAgentSchema
     from utils.message_logger import MessageLogger
-    from utils.image_utils import fetch_images_for_chunks
-    from utils.s3_operations import S3Operations
+    from utils.image_utils import fetch_images_for_chunks, to_data_url
+    from utils.s3_operations import S3Operations, get_s3_ops
 except ImportError:
     from src.state.state import MainGraphState
     from src.schemas.ConvoAgentSchema import ConvoAgentSchema
     from src.utils.message_logger import MessageLogger
-    from src.utils.image_utils import fetch_images_for_chunks
-    from src.utils.s3_operations import S3Operations
+    from src.utils.image_utils import fetch_images_for_chunks, to_data_url
+    from src.utils.s3_operations import S3Operations, get_s3_ops
 
 from langchain_core.runnables import RunnableConfig
 from langchain_core.messages import AIMessage, HumanMessage
@@ -23,18 +22,22 @@ from langgraph.config import get_stream_writer
 
 load_dotenv()
 
-# Initialize the LLM - one with structured output, one for multimodal
+# Initialize the LLM once; the structured-output variant wraps the same client.
+# The plain client serves the multimodal path (structured output may not work with images)
 Convo_Agent_LLM = init_chat_model(model=os.getenv("GOOGLE_MODEL"))
 Convo_Agent_LLM_w_Structured_Output = Convo_Agent_LLM.with_structured_output(ConvoAgentSchema)
-# Multimodal LLM without structured output (structured output may not work with images)
-Convo_Agent_LLM_Multimodal = init_chat_model(model=os.getenv("GOOGLE_MODEL"))
 
 # Initialize the message logger for human-readable message storage
 message_logger = MessageLogger()
 
+
 # Maximum images to include in context
 MAX_IMAGES_IN_CONTEXT = 10
 
+# Send the LLM presigned S3 URLs instead of downloading and inlining images.
+# Presigned URLs expire, so images fetched this way are never cached in state
+PRESIGN_IMAGE_URLS = os.getenv("PRESIGN_IMAGE_URLS", "false").lower() == "true"
+
 BASE_SYSTEM_PROMPT = """
 You are a helpful assistant. Respond to the user's message politely and helpfully 
 using gaming terms wherever appropriate.
@@ -64,6 +67,12 @@ MULTIMODAL_SYSTEM_PROMPT = """You are a helpful assistant. Respond to the user's
 
 You have access to document content and images from PDF files uploaded by the user. When the user asks about images (e.g., "describe the image on page 1"), refer to the images provided in the context. Each image is labeled with its page number."""
 
+# Leading content parts of every multimodal context message, built once
+MULTIMODAL_CONTEXT_PREFIX = (
+    {"type": "text", "text": MULTIMODAL_SYSTEM_PROMPT},
+    {"type": "text", "text": "\n\n--- DOCUMENT CONTENT AND IMAGES ---\n"},
+)
+
 
 def _build_document_context(document_chunks: list[dict] | None) -> str:
     """
@@ -76,36 +85,34 @@ def _build_document_context(document_chunks: list[dict] | None) -> str:
     
     # Group chunks by filename and page
     context_parts = []
+    append = context_parts.append
+    page_headers: dict[tuple[int, int], str] = {}
     current_file = None
     
     for chunk in document_chunks:
         filename = chunk.get("filename", "Unknown")
-        page_num = chunk.get("page_num", 0)
-        content = chunk.get("content", "")
-        image_keys = chunk.get("image_keys", [])
         
         # Add file header if switching files
         if filename != current_file:
-            context_parts.append(f"\n[FILE: {filename}]")
+            append(f"\n[FILE: {filename}]")
             current_file = filename
         
-        # Add page and content
-        page_header = f"[Page {page_num + 1}]"
-        if image_keys:
-            page_header += f" (contains {len(image_keys)} image(s))"
+        # Every chunk of a page shares its header, so build each header once
+        header_key = (chunk.get("page_num", 0), len(chunk.get("image_keys") or ()))
+        page_header = page_headers.get(header_key)
+        if page_header is None:
+            page_num, image_count = header_key
+            page_header = f"[Page {page_num + 1}]"
+            if image_count:
+                page_header += f" (contains {image_count} image(s))"
+            page_headers[header_key] = page_header
         
-        context_parts.append(f"{page_header}\n{content}")
+        # Add page and content
+        append(page_header + "\n" + chunk.get("content", ""))
     
     return "\n\n".join(context_parts)
 
 
-def _has_images(document_chunks: list[dict] | None) -> bool:
-    """Check if any chunks have images."""
-    if not document_chunks:
-        return False
-    return any(chunk.get("image_keys") for chunk in document_chunks)
-
-
 async def _build_multimodal_context(
     document_chunks: list[dict],
     s3_ops: S3Operations,
@@ -122,12 +129,21 @@ async def _build_multimodal_context(
         cached_images: Optional dict of already-fetched images (keyed by page_key)
     
     Returns:
-        Tuple of (content_parts for LLM, page_images dict for caching)
+        Tuple of (content_parts for LLM, starting with MULTIMODAL_CONTEXT_PREFIX,
+        and page_images dict for caching, empty when images were presigned)
     """
     # Use cached images if available, otherwise fetch from S3
     if cached_images:
         writer({"Progress": "Using cached images ..."})
         page_images = cached_images
+    elif PRESIGN_IMAGE_URLS:
+        writer({"Progress": "Linking images ..."})
+        page_images = await fetch_images_for_chunks(
+            document_chunks, 
+            s3_ops, 
+            max_total_images=MAX_IMAGES_IN_CONTEXT,
+            presign=True,
+        )
     else:
         writer({"Progress": "Fetching images ..."})
         page_images = await fetch_images_for_chunks(
@@ -137,10 +153,13 @@ async def _build_multimodal_context(
         )
         writer({"Progress": "Images fetched and will be cached ..."})
     
-    # Keep a copy for caching (since we delete keys during iteration)
-    images_to_cache = {k: v for k, v in page_images.items()}
+    # Track pages whose images were already added, so page_images can be
+    # returned for caching as-is instead of copied and consumed
+    seen_pages: set[str] = set()
     
-    content_parts = []
+    content_parts = list(MULTIMODAL_CONTEXT_PREFIX)
+    append = content_parts.append
+    page_prefixes: dict[int, str] = {}
     current_file = None
     
     writer({"Progress": "Building multimodal context ..."})
@@ -148,41 +167,44 @@ async def _build_multimodal_context(
     for chunk in document_chunks:
         filename = chunk.get("filename", "Unknown")
         page_num = chunk.get("page_num", 0)
-        text_content = chunk.get("content", "")
         
         # Add file header if switching files
         if filename != current_file:
-            content_parts.append({
+            append({
                 "type": "text",
                 "text": f"\n--- Document: {filename} ---\n"
             })
             current_file = filename
         
-        # Add page header and text
-        content_parts.append({
+        # Add page header and text; every chunk of a page shares its header
+        page_prefix = page_prefixes.get(page_num)
+        if page_prefix is None:
+            page_prefix = page_prefixes[page_num] = f"[Page {page_num + 1}]\n"
+        append({
             "type": "text",
-            "text": f"[Page {page_num + 1}]\n{text_content}"
+            "text": page_prefix + chunk.get("content", "")
         })
         # Add images for this page (only for first chunk of each page)
         page_key = f"{filename}:{page_num}"
-        if page_key in page_images:
+        if page_key in page_images and page_key not in seen_pages:
+            seen_pages.add(page_key)
             images = page_images[page_key]
-            for i, img in enumerate(images):
+            label_suffix = f" of {len(images)} on Page {page_num + 1}]"
+            for i, img in enumerate(images, 1):
                 # Add image label
-                content_parts.append({
+                append({
                     "type": "text",
-                    "text": f"[Image {i + 1} of {len(images)} on Page {page_num + 1}]"
+                    "text": f"[Image {i}" + label_suffix
                 })
-                # Add the image
-                content_parts.append({
+                # Add the image, encoding it only now that it is being sent
+                append({
                     "type": "image_url",
-                    "image_url": {"url": img["base64_url"]}
+                    "image_url": {"url": await to_data_url(img)}
                 })
-            # Remove from dict so we don't add again for other chunks of same page
-            del page_images[page_key]
     writer({"Progress": "Multimodal context built ..."})
-    await asyncio.sleep(1)
-    return content_parts, images_to_cache
+    if PRESIGN_IMAGE_URLS and not cached_images:
+        return content_parts, {}
+    return content_parts, page_images
 
 
 async def ConvoAgent(state: MainGraphState, config: RunnableConfig):
@@ -208,7 +230,7 @@ async def ConvoAgent(state: MainGraphState, config: RunnableConfig):
     document_context = state.get("document_context")
     cached_images = state.get("cached_images")  # Get cached images from state
     writer({"Progress": "Document read completed ..."})
-    has_images = _has_images(document_context)
+    has_images = any(chunk.get("image_keys") for chunk in document_context or ())
     writer({"Progress": "Visually understanding the document ..."})
     
     # Track images to cache (will be populated if we fetch from S3)
@@ -221,33 +243,25 @@ async def ConvoAgent(state: MainGraphState, config: RunnableConfig):
             print("[ConvoNode] Using cached images")
         
         try:
-            s3_ops = S3Operations()
+            s3_ops = get_s3_ops()
             
             # Build multimodal content with images (uses cache if available)
             multimodal_content, images_to_cache = await _build_multimodal_context(
                 document_context, s3_ops, writer, cached_images
             )
             writer({"Progress": "Multimodal context built ..."})
-            # Create the context message with system prompt and document content
-            context_content = [
-                {"type": "text", "text": MULTIMODAL_SYSTEM_PROMPT},
-                {"type": "text", "text": "\n\n--- DOCUMENT CONTENT AND IMAGES ---\n"},
-            ] + multimodal_content
-            
             # Build messages for multimodal LLM
-            # Use HumanMessage with multimodal content for the context
+            # Use HumanMessage with the system prompt, document content and images
+            # (already prefixed by _build_multimodal_context) for the context,
+            # followed by the conversation history
             messages = [
-                HumanMessage(content=context_content),
+                HumanMessage(content=multimodal_content),
                 AIMessage(content="I've reviewed the document content and images. How can I help you with this material?"),
+                *state["messages"],
             ]
             
-            # Add conversation history (text only for previous messages)
-            for msg in state["messages"]:
-                if hasattr(msg, 'content'):
-                    messages.append(msg)
-            
-            # Use multimodal LLM (without structured output)
-            response = await Convo_Agent_LLM_Multimodal.ainvoke(messages)
+            # Use the plain LLM (without structured output) for multimodal input
+            response = await Convo_Agent_LLM.ainvoke(messages)
             ai_response_content = response.content
             
         except Exception as e:
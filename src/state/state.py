@@ -5,8 +5,18 @@ from langgraph.graph import add_messages
 
 
 def add_to_conversation(existing: List[str], new: List[str]) -> List[str]:
-    """Reducer to accumulate conversation history strings."""
-    return (existing or []) + (new or [])
+    """
+    Reducer to accumulate conversation history strings.
+    
+    Returns existing unchanged when there is nothing to add, so updates that
+    don't touch the history don't copy it. Never mutates existing in place:
+    the list may be shared with earlier checkpoint snapshots.
+    """
+    if not new:
+        return existing or []
+    if not existing:
+        return list(new)
+    return existing + new
 
 
 # State schema for the graph (input + accumulated state)
@@ -14,5 +24,5 @@ class MainGraphState(TypedDict):
     messages: Annotated[List[AnyMessage], add_messages]
     conversation_history: Annotated[List[str], add_to_conversation]
     document_context: Optional[List[dict]]  # Processed PDF chunks for context
-    cached_images: Optional[dict]  # Cached base64 images keyed by "filename:page_num"
+    cached_images: Optional[dict]  # Page images keyed by "filename:page_num"; lists of {key, bytes, mime_type} with raw image bytes
     Approval: Optional[bool]
@@ -0,0 +1,61 @@
+"""
+Shared LangGraph checkpointer backed by a psycopg connection pool.
+
+Both the FastAPI app and the standalone runner open their checkpointer here,
+so pool sizing and connection settings live in one place and setup() runs
+once per process.
+"""
+
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+from dotenv import load_dotenv
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+load_dotenv()
+
+
+def _prepare_threshold(value: str) -> Optional[int]:
+    return None if value.strip().lower() in ("", "none") else int(value)
+
+
+# Executions after which psycopg prepares a query server-side, shared by
+# every connection pool in the process (checkpointer, API, message log).
+# Set DB_PREPARE_THRESHOLD=none behind a transaction-mode pooler such as
+# pgbouncer, where a statement prepared on one server connection can't be
+# executed on another
+PREPARE_THRESHOLD = _prepare_threshold(os.getenv("DB_PREPARE_THRESHOLD", "5"))
+
+
+@asynccontextmanager
+async def open_checkpointer(conn_string: Optional[str] = None) -> AsyncIterator[AsyncPostgresSaver]:
+    """
+    Open a pooled AsyncPostgresSaver with its tables set up.
+    
+    The saver needs autocommit connections with dict rows; statements are
+    prepared according to PREPARE_THRESHOLD, like every other pool.
+    
+    Args:
+        conn_string: PostgreSQL connection string (defaults to POSTGRES_URI)
+        
+    Yields:
+        Checkpointer to share across every graph invocation in the process
+    """
+    conn_string = conn_string or os.getenv("POSTGRES_URI")
+    if not conn_string:
+        raise ValueError("POSTGRES_URI environment variable is required")
+    
+    async with AsyncConnectionPool(
+        conninfo=conn_string,
+        min_size=5,
+        max_size=20,
+        max_idle=300,
+        max_lifetime=1800,
+        kwargs={"autocommit": True, "prepare_threshold": PREPARE_THRESHOLD, "row_factory": dict_row},
+    ) as checkpoint_pool:
+        checkpointer = AsyncPostgresSaver(checkpoint_pool)
+        await checkpointer.setup()
+        yield checkpointer
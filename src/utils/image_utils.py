@@ -2,14 +2,24 @@
 Image utilities for multimodal LLM support.
 
 Provides functions to fetch images from S3 and convert them to base64
-format suitable for sending to vision-capable LLMs like Gemini.
+data URLs suitable for sending to vision-capable LLMs like Gemini. Images
+are passed around as raw bytes and only encoded by to_data_url() when they
+are placed into a prompt. Alternatively, fetch_images_as_urls() hands the
+LLM presigned S3 URLs so nothing is downloaded or encoded here at all.
 """
 
 import asyncio
-import base64
 import os
+import time
+from collections import OrderedDict
 from typing import Optional
 
+# pybase64 is a drop-in replacement with SIMD encoders; use it when installed
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
 # Support both LangGraph Studio and FastAPI server imports
 try:
     from utils.s3_operations import S3Operations
@@ -27,10 +37,23 @@ MIME_TYPES = {
     "tiff": "image/tiff",
     "webp": "image/webp",
 }
+# Upper-case extensions (common from cameras and scanners) resolve without
+# lower-casing the key
+MIME_TYPES.update({ext.upper(): mime_type for ext, mime_type in MIME_TYPES.items()})
 
 # Default maximum number of images to include (to avoid token overflow)
 DEFAULT_MAX_IMAGES = 10
 
+# Maximum concurrent S3 image downloads per fetch
+IMAGE_FETCH_CONCURRENCY = 16
+
+# Lifetime of presigned image URLs handed to the LLM
+PRESIGNED_URL_EXPIRATION = 3600
+
+# Images at least this large are base64-encoded in a worker thread so the
+# encode doesn't stall other downloads on the event loop
+BASE64_THREAD_THRESHOLD = 256 * 1024
+
 
 def get_mime_type(s3_key: str) -> str:
     """
@@ -42,46 +65,159 @@ def get_mime_type(s3_key: str) -> str:
     Returns:
         MIME type string, defaults to "image/png" if unknown
     """
-    ext = s3_key.rsplit(".", 1)[-1].lower() if "." in s3_key else ""
-    return MIME_TYPES.get(ext, "image/png")
+    dot = s3_key.rfind(".")
+    if dot == -1:
+        return "image/png"
+    ext = s3_key[dot + 1:]
+    mime_type = MIME_TYPES.get(ext)
+    if mime_type is None:
+        mime_type = MIME_TYPES.get(ext.lower(), "image/png")
+    return mime_type
+
+
+# Recently fetched images, keyed by S3 key, so follow-up turns and other
+# users viewing the same document don't download them again. Entries expire
+# after IMAGE_CACHE_TTL seconds; the least recently used are evicted first
+# once either the entry count or the total size of the cached bytes is
+# exceeded. Images larger than IMAGE_CACHE_MAX_ITEM_BYTES aren't cached, so
+# a few huge slides can't flush everything else
+IMAGE_CACHE_MAXSIZE = 256
+IMAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+IMAGE_CACHE_MAX_ITEM_BYTES = IMAGE_CACHE_MAX_BYTES // 8
+IMAGE_CACHE_TTL = 600
+
+# s3_key -> (expires_at, size in bytes, image dict)
+_image_cache: OrderedDict[str, tuple[float, int, dict]] = OrderedDict()
+_image_cache_bytes = 0
 
+# Downloads in progress, so concurrent requests for one key share a fetch
+_inflight_fetches: dict[str, asyncio.Task] = {}
 
-async def fetch_single_image_as_base64(
+
+def _cache_pop(s3_key: str) -> None:
+    """Remove a cached image, if present, and release its bytes from the total."""
+    global _image_cache_bytes
+    entry = _image_cache.pop(s3_key, None)
+    if entry is not None:
+        _image_cache_bytes -= entry[1]
+
+
+def _cache_get(s3_key: str) -> Optional[dict]:
+    """Return a cached image if present and not expired."""
+    entry = _image_cache.get(s3_key)
+    if entry is None:
+        return None
+    expires_at, _, img = entry
+    if expires_at <= time.monotonic():
+        _cache_pop(s3_key)
+        return None
+    _image_cache.move_to_end(s3_key)
+    return img
+
+
+def _cache_put(s3_key: str, img: dict) -> None:
+    """Cache an image, evicting the least recently used entries when full."""
+    global _image_cache_bytes
+    size = len(img["bytes"])
+    if size > IMAGE_CACHE_MAX_ITEM_BYTES:
+        return
+    
+    _cache_pop(s3_key)
+    _image_cache[s3_key] = (time.monotonic() + IMAGE_CACHE_TTL, size, img)
+    _image_cache_bytes += size
+    while len(_image_cache) > IMAGE_CACHE_MAXSIZE or _image_cache_bytes > IMAGE_CACHE_MAX_BYTES:
+        _, (_, evicted_size, _) = _image_cache.popitem(last=False)
+        _image_cache_bytes -= evicted_size
+
+
+def _encode_base64(data: bytes) -> str:
+    """Base64-encode bytes to an ASCII string."""
+    return base64.b64encode(data).decode("ascii")
+
+
+async def fetch_single_image(
     s3_key: str,
     s3_ops: S3Operations,
 ) -> Optional[dict]:
     """
-    Fetch a single image from S3 and convert to base64.
+    Fetch a single image from S3 as raw bytes.
+    
+    Served from the in-process cache when possible; concurrent calls for
+    the same key wait on a single download.
     
     Args:
         s3_key: S3 key of the image
         s3_ops: S3Operations instance
         
     Returns:
-        Dict with key, base64 data URL, and mime_type, or None if failed
+        Dict with key, raw image bytes, and mime_type, or None if failed
     """
+    img = _cache_get(s3_key)
+    if img is not None:
+        return img
+    
+    task = _inflight_fetches.get(s3_key)
+    if task is None:
+        task = _inflight_fetches[s3_key] = asyncio.create_task(_download_image(s3_key, s3_ops))
+        task.add_done_callback(lambda _: _inflight_fetches.pop(s3_key, None))
+    
+    # Shield the shared download so one caller being cancelled doesn't
+    # cancel it for the others
+    return await asyncio.shield(task)
+
+
+async def _download_image(s3_key: str, s3_ops: S3Operations) -> Optional[dict]:
+    """Download an image from S3 and cache it on success."""
     try:
         image_bytes = await s3_ops.download_by_key(s3_key)
-        mime_type = get_mime_type(s3_key)
-        base64_data = base64.b64encode(image_bytes).decode("utf-8")
-        
-        return {
-            "key": s3_key,
-            "base64_url": f"data:{mime_type};base64,{base64_data}",
-            "mime_type": mime_type,
-        }
     except Exception as e:
         print(f"[Image Utils] Failed to fetch image {s3_key}: {e}")
         return None
+    
+    img = {
+        "key": s3_key,
+        "bytes": image_bytes,
+        "mime_type": get_mime_type(s3_key),
+    }
+    _cache_put(s3_key, img)
+    return img
+
+
+async def to_data_url(img: dict) -> str:
+    """
+    Get the URL to place in an LLM prompt for a fetched image.
+    
+    Raw bytes are encoded as a base64 data URL here, at the last moment, so
+    images that are never used are never encoded.
+    
+    Args:
+        img: Image dict from fetch_single_image or fetch_images_as_urls
+            (images cached before raw bytes were kept carry a ready-made
+            "base64_url" instead)
+        
+    Returns:
+        Presigned URL or data URL (e.g., "data:image/png;base64,...")
+    """
+    if "url" in img:
+        return img["url"]
+    if "base64_url" in img:
+        return img["base64_url"]
+    
+    image_bytes = img["bytes"]
+    if len(image_bytes) >= BASE64_THREAD_THRESHOLD:
+        base64_data = await asyncio.to_thread(_encode_base64, image_bytes)
+    else:
+        base64_data = _encode_base64(image_bytes)
+    return f"data:{img['mime_type']};base64,{base64_data}"
 
 
-async def fetch_images_as_base64(
+async def fetch_images(
     image_keys: list[str],
     s3_ops: S3Operations,
     max_images: int = DEFAULT_MAX_IMAGES,
 ) -> list[dict]:
     """
-    Fetch multiple images from S3 and convert to base64.
+    Fetch multiple images from S3 as raw bytes.
     
     Downloads images in parallel for better performance.
     
@@ -93,7 +229,7 @@ async def fetch_images_as_base64(
     Returns:
         List of dicts, each containing:
         - key: S3 key
-        - base64_url: Data URL with base64 content (e.g., "data:image/png;base64,...")
+        - bytes: Raw image content (see to_data_url)
         - mime_type: MIME type of the image
     """
     if not image_keys:
@@ -105,13 +241,17 @@ async def fetch_images_as_base64(
     if len(image_keys) > max_images:
         print(f"[Image Utils] Limiting images from {len(image_keys)} to {max_images}")
     
-    # Fetch all images in parallel
-    tasks = [
-        fetch_single_image_as_base64(key, s3_ops)
-        for key in keys_to_fetch
-    ]
+    # Fetch all images in parallel, bounded so large max_images values don't
+    # flood S3 or the worker thread pool
+    semaphore = asyncio.Semaphore(IMAGE_FETCH_CONCURRENCY)
+    
+    async def _fetch(key: str) -> Optional[dict]:
+        async with semaphore:
+            return await fetch_single_image(key, s3_ops)
     
-    results = await asyncio.gather(*tasks)
+    async with asyncio.TaskGroup() as tg:
+        tasks = [tg.create_task(_fetch(key)) for key in keys_to_fetch]
+    results = [task.result() for task in tasks]
     
     # Filter out None results (failed fetches)
     successful_results = [r for r in results if r is not None]
@@ -121,10 +261,52 @@ async def fetch_images_as_base64(
     return successful_results
 
 
+async def fetch_images_as_urls(
+    image_keys: list[str],
+    s3_ops: S3Operations,
+    max_images: int = DEFAULT_MAX_IMAGES,
+    expires: int = PRESIGNED_URL_EXPIRATION,
+) -> list[dict]:
+    """
+    Get presigned S3 URLs for images instead of downloading them.
+    
+    For LLMs that fetch image URLs themselves, this skips the S3 downloads
+    and base64 encoding entirely and keeps the request payload small.
+    
+    Args:
+        image_keys: List of S3 keys for images
+        s3_ops: S3Operations instance
+        max_images: Maximum number of images to include (to limit tokens)
+        expires: URL expiration time in seconds
+        
+    Returns:
+        List of dicts, each containing:
+        - key: S3 key
+        - url: Presigned download URL
+        - mime_type: MIME type of the image
+    """
+    if not image_keys:
+        return []
+    
+    keys_to_sign = image_keys[:max_images]
+    
+    try:
+        urls = await s3_ops.get_presigned_urls_by_key(keys_to_sign, expiration=expires)
+    except Exception as e:
+        print(f"[Image Utils] Failed to presign image URLs: {e}")
+        return []
+    
+    return [
+        {"key": key, "url": url, "mime_type": get_mime_type(key)}
+        for key, url in zip(keys_to_sign, urls)
+    ]
+
+
 async def fetch_images_for_chunks(
     document_chunks: list[dict],
     s3_ops: S3Operations,
     max_total_images: int = DEFAULT_MAX_IMAGES,
+    presign: bool = False,
 ) -> dict[str, list[dict]]:
     """
     Fetch images for all document chunks, organized by page.
@@ -133,28 +315,28 @@ async def fetch_images_for_chunks(
         document_chunks: List of chunk dicts with image_keys
         s3_ops: S3Operations instance
         max_total_images: Maximum total images across all pages
+        presign: Return presigned S3 URLs instead of downloading the images
         
     Returns:
-        Dict mapping "filename:page_num" to list of base64 image dicts
+        Dict mapping "filename:page_num" to list of image dicts
     """
     # Collect all unique image keys with their page info
     page_images: dict[str, list[str]] = {}
     all_keys: list[str] = []
+    seen_keys: set[str] = set()
     
     for chunk in document_chunks:
-        filename = chunk.get("filename", "unknown")
-        page_num = chunk.get("page_num", 0)
-        image_keys = chunk.get("image_keys", [])
+        image_keys = chunk.get("image_keys")
         
         if image_keys:
-            page_key = f"{filename}:{page_num}"
-            if page_key not in page_images:
-                page_images[page_key] = []
+            page_key = f"{chunk.get('filename', 'unknown')}:{chunk.get('page_num', 0)}"
+            page_keys = page_images.setdefault(page_key, [])
             
             for key in image_keys:
-                if key not in all_keys:  # Avoid duplicates
+                if key not in seen_keys:  # Avoid duplicates
+                    seen_keys.add(key)
                     all_keys.append(key)
-                    page_images[page_key].append(key)
+                    page_keys.append(key)
     
     if not all_keys:
         return {}
@@ -164,8 +346,11 @@ async def fetch_images_for_chunks(
         print(f"[Image Utils] Limiting total images from {len(all_keys)} to {max_total_images}")
         all_keys = all_keys[:max_total_images]
     
-    # Fetch all images
-    fetched = await fetch_images_as_base64(all_keys, s3_ops, max_images=max_total_images)
+    # Fetch all images (or just sign URLs for them)
+    if presign:
+        fetched = await fetch_images_as_urls(all_keys, s3_ops, max_images=max_total_images)
+    else:
+        fetched = await fetch_images(all_keys, s3_ops, max_images=max_total_images)
     
     # Create lookup by key
     fetched_by_key = {img["key"]: img for img in fetched}
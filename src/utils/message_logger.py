@@ -5,16 +5,57 @@ This complements LangGraph's binary checkpointing by providing a queryable
 message_history table that can be viewed directly in pgAdmin or any SQL client.
 """
 
-import json
+import asyncio
+import logging
 import os
-from datetime import datetime
-from typing import Optional
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
 
+import orjson
 import psycopg
 from dotenv import load_dotenv
+from psycopg.rows import dict_row
+from psycopg.types.json import Jsonb
+from psycopg_pool import AsyncConnectionPool
+
+# Support both LangGraph Studio and FastAPI server imports
+try:
+    from utils.checkpointer import PREPARE_THRESHOLD
+except ImportError:
+    from src.utils.checkpointer import PREPARE_THRESHOLD
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Queued messages are written in batches of up to LOG_BATCH_SIZE rows, waiting
+# at most LOG_FLUSH_INTERVAL seconds for a batch to fill (larger batches stop
+# paying off for PostgreSQL ingest around 1000 rows)
+LOG_BATCH_SIZE = 1000
+LOG_FLUSH_INTERVAL = 0.1
+
+# Arbitrary key for the advisory lock that serializes setup() DDL across workers
+SETUP_LOCK_KEY = 873215
+
+# Column order of rows passed to _write_rows
+_LOG_COLUMNS = "thread_id, user_id, role, content, message_id, attachments, created_at"
+
+
+def _attachments_param(attachments: Optional[list[dict]]) -> Jsonb:
+    """Wrap attachments as a jsonb parameter serialized with orjson."""
+    return Jsonb(attachments or [], dumps=orjson.dumps)
+
+
+def _format_message_rows(rows: list[dict]) -> list[dict]:
+    """Normalize message_history rows in place for JSON responses."""
+    for row in rows:
+        if not row["attachments"]:
+            row["attachments"] = []
+        if row["created_at"]:
+            row["created_at"] = row["created_at"].isoformat()
+    return rows
+
 
 class MessageLogger:
     """
@@ -31,15 +72,61 @@ class MessageLogger:
         )
     """
     
+    # One autocommit pool per connection string, shared by every instance
+    # (the API, ConvoNode and DomainIdentifierNode each hold a logger); only
+    # the process owner closes them, through close_pools()
+    _pools: dict[str, AsyncConnectionPool] = {}
+    _pools_lock = asyncio.Lock()
+    
     def __init__(self, conn_string: Optional[str] = None):
         self.conn_string = conn_string or os.getenv("POSTGRES_URI")
         if not self.conn_string:
             raise ValueError("POSTGRES_URI environment variable is required")
+        
+        # Background batch writer for enqueue_message(), started lazily
+        self._queue: Optional[asyncio.Queue] = None
+        self._flusher: Optional[asyncio.Task] = None
+    
+    async def _pool(self) -> AsyncConnectionPool:
+        """
+        Get the shared pool for this connection string.
+        
+        The first caller (normally setup()) opens it; the pool is published
+        only once open, so concurrent callers wait on the lock instead of
+        opening it twice.
+        """
+        pool = self._pools.get(self.conn_string)
+        if pool is None:
+            async with self._pools_lock:
+                pool = self._pools.get(self.conn_string)
+                if pool is None:
+                    pool = AsyncConnectionPool(
+                        self.conn_string,
+                        min_size=2,
+                        max_size=20,
+                        kwargs={"autocommit": True, "prepare_threshold": PREPARE_THRESHOLD},
+                        open=False,
+                    )
+                    await pool.open()
+                    self._pools[self.conn_string] = pool
+        return pool
+    
+    @asynccontextmanager
+    async def _connection(self) -> AsyncIterator[psycopg.AsyncConnection]:
+        """Borrow a connection from the shared pool."""
+        pool = await self._pool()
+        async with pool.connection() as conn:
+            yield conn
     
     async def setup(self) -> None:
         """Create the message_history table if it doesn't exist."""
-        with psycopg.connect(self.conn_string) as conn:
-            conn.execute("""
+        async with self._connection() as conn:
+            # The batch runs as one implicit transaction, so the advisory lock
+            # makes concurrent workers wait for the first one instead of
+            # racing on the catalog
+            await conn.execute(f"""
+                SELECT pg_advisory_xact_lock({SETUP_LOCK_KEY});
+                
                 CREATE TABLE IF NOT EXISTS message_history (
                     id SERIAL PRIMARY KEY,
                     thread_id TEXT NOT NULL,
@@ -54,12 +141,24 @@ class MessageLogger:
                 -- Index for fast lookups by thread
                 CREATE INDEX IF NOT EXISTS idx_message_history_thread 
                 ON message_history(thread_id, created_at);
-                
+
+                -- Flag internal bookkeeping rows once at write time so reads
+                -- don't have to pattern-match content on every query
+                ALTER TABLE message_history
+                ADD COLUMN IF NOT EXISTS is_internal BOOLEAN
+                GENERATED ALWAYS AS (content LIKE 'Gaming query: %') STORED;
+
+                -- Partial index over visible messages so thread reads walk rows
+                -- in created_at order without a sort step
+                CREATE INDEX IF NOT EXISTS idx_msg_thread_visible
+                ON message_history(thread_id, created_at)
+                INCLUDE (role, message_id, user_id)
+                WHERE NOT is_internal;
+
                 -- Index for user-specific queries
                 CREATE INDEX IF NOT EXISTS idx_message_history_user 
                 ON message_history(user_id, created_at);
             """)
-            conn.commit()
     
     async def log_message(
         self,
@@ -73,6 +172,10 @@ class MessageLogger:
         """
         Log a single message to the message_history table.
         
+        The timestamp is taken from the application clock, like the one
+        enqueue_message records, so queued and directly logged messages of
+        a conversation order correctly whatever the database clock says.
+        
         Args:
             thread_id: The conversation thread identifier
             role: Message role ('human' or 'ai')
@@ -81,17 +184,167 @@ class MessageLogger:
             message_id: Optional unique message ID from LangChain
             attachments: Optional list of file attachments [{filename, size, s3_key}]
         """
-        attachments_json = json.dumps(attachments or [])
-        
-        with psycopg.connect(self.conn_string) as conn:
-            conn.execute(
-                """
-                INSERT INTO message_history (thread_id, user_id, role, content, message_id, attachments)
-                VALUES (%s, %s, %s, %s, %s, %s::jsonb)
+        async with self._connection() as conn:
+            await conn.execute(
+                f"""
+                INSERT INTO message_history ({_LOG_COLUMNS})
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
                 """,
-                (thread_id, user_id, role, content, message_id, attachments_json)
+                (
+                    thread_id,
+                    user_id,
+                    role,
+                    content,
+                    message_id,
+                    _attachments_param(attachments),
+                    datetime.now(timezone.utc),
+                )
+            )
+    
+    def enqueue_message(
+        self,
+        thread_id: str,
+        role: str,
+        content: str,
+        user_id: Optional[str] = None,
+        message_id: Optional[str] = None,
+        attachments: Optional[list[dict]] = None
+    ) -> None:
+        """
+        Queue a message to be written by the background batch writer.
+        
+        Unlike log_message this doesn't wait on the database, so it keeps the
+        insert off the request's critical path. The timestamp is taken now so
+        ordering against directly logged messages is preserved.
+        
+        Args:
+            thread_id: The conversation thread identifier
+            role: Message role ('human' or 'ai')
+            content: The actual message text
+            user_id: Optional user identifier
+            message_id: Optional unique message ID from LangChain
+            attachments: Optional list of file attachments [{filename, size, s3_key}]
+        """
+        if self._flusher is None:
+            self._queue = asyncio.Queue()
+            self._flusher = asyncio.create_task(self._drain())
+        
+        self._queue.put_nowait((
+            thread_id,
+            user_id,
+            role,
+            content,
+            message_id,
+            _attachments_param(attachments),
+            datetime.now(timezone.utc),
+        ))
+    
+    async def log_messages(self, messages: list[dict]) -> None:
+        """
+        Log many messages in a single round trip.
+        
+        Args:
+            messages: Message dicts with the same keys as log_message's arguments
+                (thread_id, role, content and optionally user_id, message_id,
+                attachments, created_at)
+        """
+        now = datetime.now(timezone.utc)
+        await self._write_rows([
+            (
+                message["thread_id"],
+                message.get("user_id"),
+                message["role"],
+                message["content"],
+                message.get("message_id"),
+                _attachments_param(message.get("attachments")),
+                message.get("created_at") or now,
             )
-            conn.commit()
+            for message in messages
+        ])
+    
+    async def _write_rows(self, rows: list[tuple]) -> None:
+        """COPY prepared rows (in _LOG_COLUMNS order) into message_history."""
+        if not rows:
+            return
+        
+        async with self._connection() as conn:
+            async with conn.cursor() as cur:
+                async with cur.copy(f"COPY message_history ({_LOG_COLUMNS}) FROM STDIN") as copy:
+                    for row in rows:
+                        await copy.write_row(row)
+    
+    async def _insert_rows(self, rows: list[tuple]) -> None:
+        """Insert prepared rows one at a time, so one bad row doesn't lose the rest."""
+        async with self._connection() as conn:
+            for row in rows:
+                try:
+                    await conn.execute(
+                        f"INSERT INTO message_history ({_LOG_COLUMNS}) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+                        row,
+                    )
+                except Exception:
+                    logger.exception("Dropping queued %s message for thread %s", row[2], row[0])
+    
+    async def _drain(self) -> None:
+        """Write queued messages in batches until close() is called."""
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            batch = []
+            entry = await self._queue.get()
+            deadline = loop.time() + LOG_FLUSH_INTERVAL
+            
+            # Collect more entries until the batch is full or the flush
+            # interval has passed since the first one arrived
+            while True:
+                if entry is None:
+                    closing = True
+                    break
+                batch.append(entry)
+                if len(batch) >= LOG_BATCH_SIZE:
+                    break
+                if self._queue.empty():
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        entry = await asyncio.wait_for(self._queue.get(), remaining)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    entry = self._queue.get_nowait()
+            
+            try:
+                await self._write_rows(batch)
+            except Exception:
+                # Fall back to row-by-row inserts so only the rows that are
+                # actually rejected get dropped
+                logger.exception("Failed to COPY %d queued messages, inserting them one by one", len(batch))
+                try:
+                    await self._insert_rows(batch)
+                except Exception:
+                    logger.exception("Dropping %d queued messages", len(batch))
+    
+    async def close(self) -> None:
+        """
+        Flush any queued messages and stop the background writer.
+        
+        The shared pool stays open for the other loggers; see close_pools().
+        """
+        if self._flusher is not None:
+            self._queue.put_nowait(None)
+            await self._flusher
+            self._queue = None
+            self._flusher = None
+    
+    @classmethod
+    async def close_pools(cls) -> None:
+        """Close every shared pool; call once at process shutdown."""
+        async with cls._pools_lock:
+            pools = list(cls._pools.values())
+            cls._pools.clear()
+            for pool in pools:
+                await pool.close()
     
     async def get_thread_messages(self, thread_id: str, limit: int = 100) -> list[dict]:
         """
@@ -104,8 +357,9 @@ class MessageLogger:
         Returns:
             List of message dictionaries ordered by creation time
         """
-        with psycopg.connect(self.conn_string) as conn:
-            cursor = conn.execute(
+        async with self._connection() as conn:
+            cursor = conn.cursor(row_factory=dict_row)
+            await cursor.execute(
                 """
                 SELECT id, thread_id, user_id, role, content, message_id, attachments, created_at
                 FROM message_history
@@ -113,23 +367,11 @@ class MessageLogger:
                 ORDER BY created_at ASC
                 LIMIT %s
                 """,
-                (thread_id, limit)
+                (thread_id, limit),
             )
-            rows = cursor.fetchall()
-            
-            return [
-                {
-                    "id": row[0],
-                    "thread_id": row[1],
-                    "user_id": row[2],
-                    "role": row[3],
-                    "content": row[4],
-                    "message_id": row[5],
-                    "attachments": row[6] if row[6] else [],
-                    "created_at": row[7].isoformat() if row[7] else None
-                }
-                for row in rows
-            ]
+            rows = await cursor.fetchall()
+        
+        return _format_message_rows(rows)
     
     async def get_user_messages(self, user_id: str, limit: int = 100) -> list[dict]:
         """
@@ -142,8 +384,9 @@ class MessageLogger:
         Returns:
             List of message dictionaries ordered by creation time
         """
-        with psycopg.connect(self.conn_string) as conn:
-            cursor = conn.execute(
+        async with self._connection() as conn:
+            cursor = conn.cursor(row_factory=dict_row)
+            await cursor.execute(
                 """
                 SELECT id, thread_id, user_id, role, content, message_id, attachments, created_at
                 FROM message_history
@@ -151,20 +394,8 @@ class MessageLogger:
                 ORDER BY created_at DESC
                 LIMIT %s
                 """,
-                (user_id, limit)
+                (user_id, limit),
             )
-            rows = cursor.fetchall()
-            
-            return [
-                {
-                    "id": row[0],
-                    "thread_id": row[1],
-                    "user_id": row[2],
-                    "role": row[3],
-                    "content": row[4],
-                    "message_id": row[5],
-                    "attachments": row[6] if row[6] else [],
-                    "created_at": row[7].isoformat() if row[7] else None
-                }
-                for row in rows
-            ]
+            rows = await cursor.fetchall()
+        
+        return _format_message_rows(rows)
@@ -5,18 +5,43 @@ Processes PDFs into chunks suitable for LLM context, with images uploaded to S3.
 """
 
 import asyncio
-from dataclasses import dataclass
+import hashlib
+import math
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
 from io import BytesIO
-from typing import Optional
+from typing import AsyncIterator, Optional
 
 import pymupdf
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 # Support both LangGraph Studio and FastAPI server imports
 try:
-    from utils.s3_operations import S3Operations
+    from utils.s3_operations import S3Operations, get_s3_ops
 except ImportError:
-    from src.utils.s3_operations import S3Operations
+    from src.utils.s3_operations import S3Operations, get_s3_ops
+
+# Maximum concurrent image uploads per processed document, shared by all of
+# its pages so the S3 client's connection pool isn't exhausted
+IMAGE_UPLOAD_CONCURRENCY = 8
+
+# PDFs with more pages than this are extracted across worker processes, in
+# one contiguous page range per worker (MuPDF isn't thread-safe, so pages
+# are parallelized across processes rather than threads)
+PARALLEL_EXTRACT_MIN_PAGES = 20
+EXTRACT_WORKERS = os.cpu_count() or 1
+
+# Plain-text extraction flags: positions and image blocks are discarded
+# anyway, and expanding ligatures gives the splitter ordinary characters
+TEXT_EXTRACT_FLAGS = (
+    pymupdf.TEXTFLAGS_TEXT
+    & ~pymupdf.TEXT_PRESERVE_IMAGES
+    & ~pymupdf.TEXT_PRESERVE_LIGATURES
+)
 
 
 @dataclass
@@ -42,6 +67,70 @@ class PageData:
     page_num: int
     text: str
     images: list[tuple[bytes, str]]  # (image_bytes, extension)
+    # Content digests of images an earlier page already carried, so their
+    # bytes aren't kept alive or handed over again
+    repeated_images: list[bytes] = field(default_factory=list)
+
+
+@lru_cache(maxsize=8)
+def get_text_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    """
+    Get the shared text splitter for a chunk size and overlap.
+    
+    Splitters hold no per-document state, so processors with the same
+    settings (every PDF and PPTX upload, by default) share one instance.
+    
+    Args:
+        chunk_size: Maximum size of each text chunk
+        chunk_overlap: Overlap between chunks for context continuity
+        
+    Returns:
+        RecursiveCharacterTextSplitter for those settings
+    """
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=["\n\n", "\n", ". ", " ", ""],
+    )
+
+
+def _open_pdf(pdf: bytes | str) -> pymupdf.Document:
+    """Open a PDF from raw bytes or from a local file path."""
+    if isinstance(pdf, str):
+        return pymupdf.open(pdf)
+    return pymupdf.open(stream=pdf, filetype="pdf")
+
+
+@lru_cache(maxsize=1)
+def get_extract_pool() -> ProcessPoolExecutor:
+    """Create the extraction process pool shared by the PDF and PPTX processors on first use."""
+    # Workers are started from a forkserver rather than forked from the
+    # server process, whose S3, transfer and database pool threads may hold
+    # locks at fork time that a forked child would inherit and deadlock on
+    return ProcessPoolExecutor(
+        max_workers=EXTRACT_WORKERS,
+        mp_context=multiprocessing.get_context("forkserver"),
+    )
+
+
+def _extract_range(pdf: bytes | str, start: int, stop: int) -> list[PageData]:
+    """
+    Extract pages [start, stop) of a PDF in a worker process.
+    
+    Args:
+        pdf: Raw PDF file content or path to the PDF
+        start: First page number to extract
+        stop: Page number to stop before
+        
+    Returns:
+        List of PageData objects, one per page
+    """
+    extracted: dict[int, bytes] = {}
+    with _open_pdf(pdf) as doc:
+        return [
+            PDFProcessor._extract_page(doc, page_num, extracted)
+            for page_num in range(start, stop)
+        ]
 
 
 class PDFProcessor:
@@ -69,56 +158,112 @@ class PDFProcessor:
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         self.s3_ops = s3_ops
+        self._upload_semaphore = asyncio.Semaphore(IMAGE_UPLOAD_CONCURRENCY)
         
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", ". ", " ", ""],
-        )
+        # Uploads keyed by (user_id, thread_id, content digest), so an image
+        # repeated across pages (logos, headers) is stored once and its key reused
+        self._image_uploads: dict[tuple[str, str, bytes], asyncio.Task] = {}
+        
+        self.text_splitter = get_text_splitter(chunk_size, chunk_overlap)
     
-    def _extract_pages(self, pdf_bytes: bytes) -> list[PageData]:
+    @staticmethod
+    def _extract_page(
+        doc: pymupdf.Document,
+        page_num: int,
+        extracted: dict[int, bytes],
+    ) -> PageData:
         """
-        Extract text and images from each page of a PDF.
+        Extract text and images from a single page of an open PDF.
         
         Args:
-            pdf_bytes: Raw PDF file content
+            doc: Open PyMuPDF document
+            page_num: Zero-based page number
+            extracted: Content digests of images already extracted from
+                the document by xref; updated with this page's images
             
         Returns:
-            List of PageData objects, one per page
+            PageData for the page
         """
-        pages_data = []
+        page = doc[page_num]
         
-        # Open PDF from bytes
-        doc = pymupdf.open(stream=pdf_bytes, filetype="pdf")
+        # Extract text from page
+        text = page.get_text("text", flags=TEXT_EXTRACT_FLAGS)
+        
+        # Extract images
+        images = []
+        repeated_images = []
+        extract_image = doc.extract_image
+        for img in page.get_images():
+            xref = img[0]
+            # Images shared between pages are only decoded once; later pages
+            # refer to them by digest, so only the first page holds the bytes
+            digest = extracted.get(xref)
+            if digest is not None:
+                repeated_images.append(digest)
+                continue
+            try:
+                base_image = extract_image(xref)
+                image_bytes = base_image["image"]
+                extracted[xref] = hashlib.blake2b(image_bytes, digest_size=16).digest()
+                images.append((image_bytes, base_image["ext"]))
+            except Exception:
+                # Skip images that can't be extracted
+                continue
+        
+        return PageData(
+            page_num=page_num,
+            text=text,
+            images=images,
+            repeated_images=repeated_images,
+        )
+    
+    async def _iter_pages(self, pdf: bytes | str) -> AsyncIterator[PageData]:
+        """
+        Extract the pages of a PDF without blocking the event loop.
+        
+        Pages are handed to the caller as soon as they are extracted, so
+        their images can be uploaded while later pages are being extracted.
+        Small PDFs are extracted one page at a time in a worker thread, since
+        MuPDF documents aren't thread-safe; larger ones are split into page
+        ranges extracted in parallel by worker processes.
+        
+        Args:
+            pdf: Raw PDF file content or path to the PDF; workers open a
+                path themselves rather than receiving a copy of the bytes
+            
+        Yields:
+            PageData objects, in page order
+        """
+        doc = await asyncio.to_thread(_open_pdf, pdf)
         
         try:
-            for page_num, page in enumerate(doc):
-                # Extract text from page
-                text = page.get_text("text")
-                
-                # Extract images
-                images = []
-                for img in page.get_images():
-                    xref = img[0]
-                    try:
-                        base_image = doc.extract_image(xref)
-                        image_bytes = base_image["image"]
-                        extension = base_image["ext"]
-                        images.append((image_bytes, extension))
-                    except Exception:
-                        # Skip images that can't be extracted
-                        continue
-                
-                pages_data.append(PageData(
-                    page_num=page_num,
-                    text=text,
-                    images=images,
-                ))
+            page_count = doc.page_count
+            if page_count <= PARALLEL_EXTRACT_MIN_PAGES:
+                extracted: dict[int, bytes] = {}
+                for page_num in range(page_count):
+                    yield await asyncio.to_thread(self._extract_page, doc, page_num, extracted)
+                return
         finally:
             doc.close()
         
-        return pages_data
+        # Dispatch every range up front, then yield them in page order as
+        # each one completes
+        loop = asyncio.get_running_loop()
+        pool = get_extract_pool()
+        pages_per_worker = math.ceil(page_count / EXTRACT_WORKERS)
+        futures = [
+            loop.run_in_executor(
+                pool, _extract_range, pdf, start, min(start + pages_per_worker, page_count)
+            )
+            for start in range(0, page_count, pages_per_worker)
+        ]
+        try:
+            for future in futures:
+                for page_data in await future:
+                    yield page_data
+        finally:
+            for future in futures:
+                future.cancel()
     
     async def _upload_images(
         self,
@@ -127,6 +272,7 @@ class PDFProcessor:
         user_id: str,
         thread_id: str,
         filename: str,
+        repeated_images: Optional[list[bytes]] = None,
     ) -> list[str]:
         """
         Upload extracted images to S3.
@@ -137,34 +283,76 @@ class PDFProcessor:
             user_id: User identifier
             thread_id: Thread identifier
             filename: Original PDF filename for organizing images
+            repeated_images: Digests of images an earlier page already
+                carried; their keys are taken from that page's uploads
             
         Returns:
             List of S3 keys for uploaded images
         """
-        if not self.s3_ops or not images:
+        if not self.s3_ops or not (images or repeated_images):
             return []
         
-        image_keys = []
         base_name = filename.rsplit(".", 1)[0]
         
+        # Register every upload before awaiting anything. Pages are handed
+        # over in order, so an earlier page's uploads are always registered
+        # by the time a later page refers to them by digest
+        tasks = []
         for img_idx, (image_bytes, ext) in enumerate(images):
-            image_filename = f"{base_name}_page{page_num}_img{img_idx}.{ext}"
+            digest = hashlib.blake2b(image_bytes, digest_size=16).digest()
+            upload_id = (user_id, thread_id, digest)
+            task = self._image_uploads.get(upload_id)
+            if task is None:
+                image_filename = f"{base_name}_page{page_num}_img{img_idx}.{ext}"
+                task = self._image_uploads[upload_id] = asyncio.create_task(
+                    self._upload_image(image_bytes, image_filename, user_id, thread_id)
+                )
+            tasks.append(task)
+        for digest in repeated_images or []:
+            task = self._image_uploads.get((user_id, thread_id, digest))
+            if task is not None:
+                tasks.append(task)
+        
+        # Upload all images in parallel, keeping keys in image order (repeats
+        # last); an image already uploaded from an earlier page reuses that upload
+        results = await asyncio.gather(*tasks)
+        image_keys = list(dict.fromkeys(key for key in results if key is not None))
+        
+        return image_keys
+    
+    async def _upload_image(
+        self,
+        image_bytes: bytes,
+        image_filename: str,
+        user_id: str,
+        thread_id: str,
+    ) -> Optional[str]:
+        """
+        Upload one extracted image to S3.
+        
+        Args:
+            image_bytes: Image content
+            image_filename: Filename to store the image under
+            user_id: User identifier
+            thread_id: Thread identifier
             
-            try:
+        Returns:
+            S3 key of the uploaded image, or None if the upload failed
+        """
+        try:
+            async with self._upload_semaphore:
                 result = await self.s3_ops.upload_file(
                     file_data=image_bytes,
                     filename=image_filename,
                     user_id=user_id,
                     thread_id=thread_id,
                 )
-                image_keys.append(result["key"])
-                print(f"Uploaded image: {result['key']}")
-            except Exception as e:
-                # Log error but continue with other images
-                print(f"Failed to upload image {image_filename}: {e}")
-                continue
-        
-        return image_keys
+            print(f"Uploaded image: {result['key']}")
+            return result["key"]
+        except Exception as e:
+            # Log error but continue with other images
+            print(f"Failed to upload image {image_filename}: {e}")
+            return None
     
     def _chunk_text(self, text: str) -> list[str]:
         """
@@ -182,9 +370,65 @@ class PDFProcessor:
         chunks = self.text_splitter.split_text(text)
         return chunks
     
+    async def _process_page(
+        self,
+        page_data: PageData,
+        user_id: str,
+        thread_id: str,
+        filename: str,
+    ) -> list[DocumentChunk]:
+        """
+        Upload a page's images and split its text into chunks.
+        
+        Args:
+            page_data: Extracted page
+            user_id: User identifier for S3 organization
+            thread_id: Thread identifier for S3 organization
+            filename: Original filename of the PDF
+            
+        Returns:
+            DocumentChunk objects for the page
+        """
+        # Upload images for this page
+        print(f"[PDF Processor] Page {page_data.page_num}: {len(page_data.images)} images to upload")
+        image_keys = await self._upload_images(
+            images=page_data.images,
+            page_num=page_data.page_num,
+            user_id=user_id,
+            thread_id=thread_id,
+            filename=filename,
+            repeated_images=page_data.repeated_images,
+        )
+        print(f"[PDF Processor] Page {page_data.page_num}: uploaded image_keys = {image_keys}")
+        
+        # Chunk the text
+        text_chunks = self._chunk_text(page_data.text)
+        
+        if text_chunks:
+            # Create DocumentChunk for each text chunk; only the first chunk
+            # of each page carries the page's image keys
+            return [
+                DocumentChunk(
+                    page_num=page_data.page_num,
+                    chunk_index=chunk_idx,
+                    content=chunk_text,
+                    image_keys=image_keys if chunk_idx == 0 else [],
+                )
+                for chunk_idx, chunk_text in enumerate(text_chunks)
+            ]
+        if image_keys:
+            # Page has images but no text - create a placeholder chunk
+            return [DocumentChunk(
+                page_num=page_data.page_num,
+                chunk_index=0,
+                content=f"[Page {page_data.page_num + 1}: Contains {len(image_keys)} image(s)]",
+                image_keys=image_keys,
+            )]
+        return []
+    
     async def process_pdf(
         self,
-        pdf_bytes: bytes,
+        pdf: bytes | str,
         user_id: str,
         thread_id: str,
         filename: str,
@@ -193,7 +437,7 @@ class PDFProcessor:
         Process a PDF file, extracting text chunks and uploading images.
         
         Args:
-            pdf_bytes: Raw PDF file content
+            pdf: Raw PDF file content, or a path to a local PDF file
             user_id: User identifier for S3 organization
             thread_id: Thread identifier for S3 organization
             filename: Original filename of the PDF
@@ -201,46 +445,17 @@ class PDFProcessor:
         Returns:
             List of DocumentChunk objects ready for database storage
         """
-        # Extract pages in a thread to avoid blocking
-        pages_data = await asyncio.to_thread(self._extract_pages, pdf_bytes)
+        # Upload each page's images while later pages are still being
+        # extracted; chunks are reassembled in page order afterwards
+        async with asyncio.TaskGroup() as tg:
+            page_tasks = [
+                tg.create_task(self._process_page(page_data, user_id, thread_id, filename))
+                async for page_data in self._iter_pages(pdf)
+            ]
         
         all_chunks = []
-        
-        for page_data in pages_data:
-            # Upload images for this page
-            print(f"[PDF Processor] Page {page_data.page_num}: {len(page_data.images)} images to upload")
-            image_keys = await self._upload_images(
-                images=page_data.images,
-                page_num=page_data.page_num,
-                user_id=user_id,
-                thread_id=thread_id,
-                filename=filename,
-            )
-            print(f"[PDF Processor] Page {page_data.page_num}: uploaded image_keys = {image_keys}")
-            
-            # Chunk the text
-            text_chunks = self._chunk_text(page_data.text)
-            
-            if text_chunks:
-                # Create DocumentChunk for each text chunk
-                for chunk_idx, chunk_text in enumerate(text_chunks):
-                    # Only attach image keys to the first chunk of each page
-                    chunk_image_keys = image_keys if chunk_idx == 0 else []
-                    
-                    all_chunks.append(DocumentChunk(
-                        page_num=page_data.page_num,
-                        chunk_index=chunk_idx,
-                        content=chunk_text,
-                        image_keys=chunk_image_keys,
-                    ))
-            elif image_keys:
-                # Page has images but no text - create a placeholder chunk
-                all_chunks.append(DocumentChunk(
-                    page_num=page_data.page_num,
-                    chunk_index=0,
-                    content=f"[Page {page_data.page_num + 1}: Contains {len(image_keys)} image(s)]",
-                    image_keys=image_keys,
-                ))
+        for task in page_tasks:
+            all_chunks.extend(task.result())
         
         return all_chunks
 
@@ -254,7 +469,8 @@ async def process_uploaded_file(
     """
     Background task to process an uploaded PDF file.
     
-    Downloads from S3, processes, and stores chunks in the database.
+    Downloads from S3 to a temporary file, processes, and stores chunks in
+    the database.
     
     Args:
         s3_key: S3 key of the uploaded file
@@ -274,21 +490,24 @@ async def process_uploaded_file(
         from src.api.database import save_document_chunks
     
     try:
-        s3_ops = S3Operations()
-        
-        # Download the PDF from S3
-        print(f"[PDF Processor] Downloading {filename} from S3...")
-        pdf_bytes = await s3_ops.download_file(filename, user_id, thread_id)
-        print(f"[PDF Processor] Downloaded {len(pdf_bytes)} bytes")
+        s3_ops = get_s3_ops()
         
-        # Process the PDF
-        processor = PDFProcessor(s3_ops=s3_ops)
-        chunks = await processor.process_pdf(
-            pdf_bytes=pdf_bytes,
-            user_id=user_id,
-            thread_id=thread_id,
-            filename=filename,
-        )
+        # Download the PDF from S3 into a temporary file, so it isn't held in
+        # memory whole and MuPDF (and extraction workers) read pages from disk
+        with tempfile.TemporaryDirectory(prefix="pdf_processor_") as tmp_dir:
+            pdf_path = os.path.join(tmp_dir, "document.pdf")
+            print(f"[PDF Processor] Downloading {filename} from S3...")
+            pdf_size = await s3_ops.download_file_to_path(filename, user_id, thread_id, pdf_path)
+            print(f"[PDF Processor] Downloaded {pdf_size} bytes")
+            
+            # Process the PDF
+            processor = PDFProcessor(s3_ops=s3_ops)
+            chunks = await processor.process_pdf(
+                pdf=pdf_path,
+                user_id=user_id,
+                thread_id=thread_id,
+                filename=filename,
+            )
         print(f"[PDF Processor] Extracted {len(chunks)} chunks")
         
         # Save to database
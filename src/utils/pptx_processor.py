@@ -5,21 +5,123 @@ Processes PPTX files into chunks suitable for LLM context, with images uploaded
 """
 
 import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from io import BytesIO
-from typing import Optional
+from typing import AsyncIterator, Iterator, Optional
 
 from pptx import Presentation
 from pptx.util import Inches
 from pptx.enum.shapes import MSO_SHAPE_TYPE
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 # Support both LangGraph Studio and FastAPI server imports
 try:
-    from utils.s3_operations import S3Operations
-    from utils.pdf_processor import DocumentChunk, PageData
+    from utils.s3_operations import ALLOWED_FILE_TYPES, S3Operations, get_s3_ops
+    from utils.pdf_processor import DocumentChunk, PageData, get_extract_pool, get_text_splitter
 except ImportError:
-    from src.utils.s3_operations import S3Operations
-    from src.utils.pdf_processor import DocumentChunk, PageData
+    from src.utils.s3_operations import ALLOWED_FILE_TYPES, S3Operations, get_s3_ops
+    from src.utils.pdf_processor import DocumentChunk, PageData, get_extract_pool, get_text_splitter
+
+logger = logging.getLogger(__name__)
+
+# Maximum concurrent image uploads per processed presentation, kept below
+# the S3 client's connection pool size
+IMAGE_UPLOAD_CONCURRENCY = 16
+
+# Threads used to extract the slides of one presentation in parallel
+SLIDE_EXTRACT_WORKERS = min(8, os.cpu_count() or 1)
+
+# Slides extracted ahead of the one being consumed, and slides whose images
+# may be awaiting upload at once; bounds how many slides' image bytes are
+# held in memory for one presentation
+SLIDE_PREFETCH = SLIDE_EXTRACT_WORKERS * 2
+
+# Presentations at least this large (in bytes) are parsed in a worker
+# process of the shared extraction pool instead, so concurrent decks don't
+# contend for the GIL; below it the pickling round trip outweighs the gain
+PROCESS_EXTRACT_MIN_BYTES = 5 * 1024 * 1024
+
+# Shape type values bound once as plain ints, so the per-shape checks skip
+# the enum attribute lookups (MSO_SHAPE_TYPE members are int-valued and
+# compare and hash like their ints)
+_GROUP = int(MSO_SHAPE_TYPE.GROUP)
+_PICTURE = int(MSO_SHAPE_TYPE.PICTURE)
+
+# Shape types that can carry a text frame or table; other shapes (lines,
+# connectors, charts, media) are never inspected for text
+_TEXTUAL_SHAPE_TYPES = frozenset({
+    int(MSO_SHAPE_TYPE.TEXT_BOX),
+    int(MSO_SHAPE_TYPE.PLACEHOLDER),
+    int(MSO_SHAPE_TYPE.AUTO_SHAPE),
+    int(MSO_SHAPE_TYPE.FREEFORM),
+    int(MSO_SHAPE_TYPE.TABLE),
+})
+
+# Slide chunks shorter than this are merged into a neighbour, as long as the
+# result stays within chunk_size + CHUNK_SIZE_SLACK
+MIN_CHUNK_SIZE = 100
+CHUNK_SIZE_SLACK = 150
+
+
+@lru_cache(maxsize=1)
+def _get_slide_pool() -> ThreadPoolExecutor:
+    """Create the shared slide-extraction thread pool on first use."""
+    return ThreadPoolExecutor(max_workers=SLIDE_EXTRACT_WORKERS, thread_name_prefix="pptx-slide")
+
+
+def _extract_slides(pptx: bytes | str) -> list[PageData]:
+    """
+    Extract every slide of a PPTX in a worker process.
+    
+    Args:
+        pptx: Raw PPTX file content or path to the PPTX
+        
+    Returns:
+        List of PageData objects, one per slide
+    """
+    processor = PPTXProcessor()
+    prs = Presentation(pptx if isinstance(pptx, str) else BytesIO(pptx))
+    return [
+        processor._process_single_slide(slide_num, slide)
+        for slide_num, slide in enumerate(prs.slides)
+    ]
+
+
+def _merge_tiny_chunks(chunks: list[str], min_size: int, max_size: int) -> list[str]:
+    """
+    Greedily merge chunks shorter than min_size into their neighbours.
+    
+    With chunk overlap, a tiny chunk is often already contained at the edge
+    of its neighbour; it is then dropped rather than glued on again.
+    
+    Args:
+        chunks: Text chunks in order
+        min_size: Chunks shorter than this are merged
+        max_size: Merged chunks never grow beyond this
+        
+    Returns:
+        Merged chunks in order
+    """
+    merged: list[str] = []
+    for chunk in chunks:
+        if merged and (len(chunk) < min_size or len(merged[-1]) < min_size):
+            previous = merged[-1]
+            if previous.endswith(chunk):
+                continue
+            if chunk.startswith(previous):
+                merged[-1] = chunk
+                continue
+            if len(previous) + 1 + len(chunk) <= max_size:
+                merged[-1] = previous + "\n" + chunk
+                continue
+        merged.append(chunk)
+    return merged
 
 
 class PPTXProcessor:
@@ -47,13 +149,14 @@ class PPTXProcessor:
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         self.s3_ops = s3_ops
+        self._upload_semaphore = asyncio.Semaphore(IMAGE_UPLOAD_CONCURRENCY)
         
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", ". ", " ", ""],
-        )
+        # S3 key (or None if the upload failed) per (user_id, thread_id,
+        # content digest), so an image repeated across slides (logos,
+        # backgrounds) is uploaded once and its key reused
+        self._image_uploads: dict[tuple[str, str, bytes], asyncio.Future] = {}
+        
+        self.text_splitter = get_text_splitter(chunk_size, chunk_overlap)
     
     def _extract_text_from_shape(self, shape) -> str:
         """
@@ -101,7 +204,7 @@ class PPTXProcessor:
         images = []
         
         # Check if shape is a picture
-        if shape.shape_type == MSO_SHAPE_TYPE.PICTURE:
+        if shape.shape_type == _PICTURE:
             try:
                 image = shape.image
                 image_bytes = image.blob
@@ -114,58 +217,143 @@ class PPTXProcessor:
         
         return images
     
-    def _extract_slides(self, pptx_bytes: bytes) -> list[PageData]:
+    def _process_single_slide(self, slide_num: int, slide) -> PageData:
         """
-        Extract text and images from each slide of a PPTX.
+        Extract text and images from a single slide.
         
         Args:
-            pptx_bytes: Raw PPTX file content
+            slide_num: Zero-based slide number
+            slide: A pptx slide object
             
         Returns:
-            List of PageData objects, one per slide
+            PageData for the slide
         """
-        slides_data = []
-        
-        # Open PPTX from bytes
-        prs = Presentation(BytesIO(pptx_bytes))
+        slide_text_parts = []
+        slide_images = []
         
-        for slide_num, slide in enumerate(prs.slides):
-            slide_text_parts = []
-            slide_images = []
-            
-            # Process each shape in the slide
-            for shape in slide.shapes:
-                # Extract text
-                text = self._extract_text_from_shape(shape)
-                if text:
-                    slide_text_parts.append(text)
+        # Walk every shape, including those nested in groups at any depth,
+        # exactly once and in document order (children are pushed reversed
+        # so they pop in order)
+        stack = list(reversed(slide.shapes))
+        while stack:
+            shape = stack.pop()
+            try:
+                shape_type = shape.shape_type
+                
+                # Descend into grouped shapes
+                if shape_type == _GROUP:
+                    stack.extend(reversed(shape.shapes))
                 
-                # Extract images
-                images = self._extract_images_from_shape(shape)
-                slide_images.extend(images)
+                # Pictures carry no text, so go straight to image extraction
+                elif shape_type == _PICTURE:
+                    slide_images.extend(self._extract_images_from_shape(shape))
                 
-                # Handle grouped shapes
-                if shape.shape_type == MSO_SHAPE_TYPE.GROUP:
-                    try:
-                        for sub_shape in shape.shapes:
-                            text = self._extract_text_from_shape(sub_shape)
-                            if text:
-                                slide_text_parts.append(text)
-                            images = self._extract_images_from_shape(sub_shape)
-                            slide_images.extend(images)
-                    except Exception:
-                        pass
+                # Extract text, only from shapes that can hold a text frame or table
+                elif shape_type in _TEXTUAL_SHAPE_TYPES:
+                    text = self._extract_text_from_shape(shape)
+                    if text:
+                        slide_text_parts.append(text)
+            except Exception:
+                # Skip malformed shapes
+                continue
+        
+        # Combine all text from the slide
+        slide_text = "\n\n".join(slide_text_parts)
+        
+        return PageData(
+            page_num=slide_num,
+            text=slide_text,
+            images=slide_images,
+        )
+    
+    def _iter_slides(self, pptx: bytes | str) -> Iterator[PageData]:
+        """
+        Extract text and images from each slide of a PPTX.
+        
+        Slides are processed in parallel on a shared thread pool and yielded
+        in slide order as they complete. At most SLIDE_PREFETCH slides are
+        submitted ahead of the one last yielded.
+        
+        Args:
+            pptx: Raw PPTX file content or path to the PPTX
             
-            # Combine all text from the slide
-            slide_text = "\n\n".join(slide_text_parts)
+        Yields:
+            PageData objects, one per slide
+        """
+        # Open PPTX from a path, or from bytes (BytesIO shares the buffer
+        # until written, and python-pptx only reads it)
+        prs = Presentation(pptx if isinstance(pptx, str) else BytesIO(pptx))
+        pool = _get_slide_pool()
+        pending = deque()
+        try:
+            for slide_num, slide in enumerate(prs.slides):
+                if len(pending) >= SLIDE_PREFETCH:
+                    yield pending.popleft().result()
+                pending.append(pool.submit(self._process_single_slide, slide_num, slide))
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # Drop slides not yet started if the caller stops early
+            for future in pending:
+                future.cancel()
+    
+    async def _iter_slides_async(self, pptx: bytes | str) -> AsyncIterator[PageData]:
+        """
+        Drive _iter_slides from a worker thread, handing over each slide as
+        soon as it is extracted.
+        
+        Presentations of PROCESS_EXTRACT_MIN_BYTES or more are instead
+        extracted whole by a worker process, and their slides yielded once
+        it finishes.
+        
+        Args:
+            pptx: Raw PPTX file content or path to the PPTX; a worker process
+                opens a path itself rather than receiving a copy of the bytes
             
-            slides_data.append(PageData(
-                page_num=slide_num,
-                text=slide_text,
-                images=slide_images,
-            ))
+        Yields:
+            PageData objects, in slide order
+        """
+        loop = asyncio.get_running_loop()
+        size = os.path.getsize(pptx) if isinstance(pptx, str) else len(pptx)
+        if size >= PROCESS_EXTRACT_MIN_BYTES:
+            for slide_data in await loop.run_in_executor(get_extract_pool(), _extract_slides, pptx):
+                yield slide_data
+            return
         
-        return slides_data
+        # Bounded, so the worker blocks rather than extracting further ahead
+        # of a slow consumer
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SLIDE_PREFETCH)
+        stop = threading.Event()
+        done = object()
+        
+        def _put(item) -> None:
+            asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+        
+        def _produce():
+            try:
+                for slide_data in self._iter_slides(pptx):
+                    if stop.is_set():
+                        break
+                    _put(slide_data)
+            except Exception as e:
+                _put(e)
+            finally:
+                _put(done)
+        
+        producer = loop.run_in_executor(None, _produce)
+        item = None
+        try:
+            while (item := await queue.get()) is not done:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Let the worker stop early if the consumer bails out, draining
+            # the queue so its blocked puts complete
+            stop.set()
+            while item is not done:
+                item = await queue.get()
+            await asyncio.shield(producer)
     
     async def _upload_images(
         self,
@@ -178,9 +366,13 @@ class PPTXProcessor:
         """
         Upload extracted images to S3.
         
+        Images are named by content hash, so each distinct image is stored
+        once per presentation (and re-processing a deck rewrites the same
+        keys); repeats wait on the first upload and reuse its key.
+        
         Args:
             images: List of (image_bytes, extension) tuples
-            slide_num: Slide number for naming
+            slide_num: Slide number for logging
             user_id: User identifier
             thread_id: Thread identifier
             filename: Original PPTX filename for organizing images
@@ -191,25 +383,51 @@ class PPTXProcessor:
         if not self.s3_ops or not images:
             return []
         
-        image_keys = []
+        # Resolve every new image's filename and content type up front, then
+        # upload them in one call; extensions S3Operations doesn't accept are
+        # skipped
+        loop = asyncio.get_running_loop()
         base_name = filename.rsplit(".", 1)[0]
+        items = []
+        owned: list[asyncio.Future] = []
+        futures: list[asyncio.Future] = []
+        for image_bytes, ext in images:
+            digest = hashlib.blake2b(image_bytes, digest_size=16).digest()
+            upload_id = (user_id, thread_id, digest)
+            future = self._image_uploads.get(upload_id)
+            if future is None:
+                image_filename = f"{base_name}_img_{digest.hex()[:12]}.{ext}"
+                content_type = ALLOWED_FILE_TYPES.get(f".{ext.lower()}")
+                if content_type is None:
+                    logger.warning("Skipping image %s: unsupported type", image_filename)
+                    continue
+                future = self._image_uploads[upload_id] = loop.create_future()
+                items.append((image_bytes, image_filename, content_type))
+                owned.append(future)
+            futures.append(future)
         
-        for img_idx, (image_bytes, ext) in enumerate(images):
-            image_filename = f"{base_name}_slide{slide_num}_img{img_idx}.{ext}"
-            
-            try:
-                result = await self.s3_ops.upload_file(
-                    file_data=image_bytes,
-                    filename=image_filename,
-                    user_id=user_id,
-                    thread_id=thread_id,
-                )
-                image_keys.append(result["key"])
-                print(f"Uploaded image: {result['key']}")
-            except Exception as e:
-                # Log error but continue with other images
-                print(f"Failed to upload image {image_filename}: {e}")
-                continue
+        try:
+            results = await self.s3_ops.upload_many_bytes(
+                items, user_id, thread_id, semaphore=self._upload_semaphore
+            )
+            for future, result in zip(owned, results):
+                if "error" in result:
+                    # Log error but continue with other images
+                    logger.warning("Failed to upload image %s: %s", result["filename"], result["error"])
+                    future.set_result(None)
+                else:
+                    logger.debug("Uploaded image: %s", result["key"])
+                    future.set_result(result["key"])
+        finally:
+            # Don't leave other slides waiting if this upload was cancelled
+            for future in owned:
+                if not future.done():
+                    future.cancel()
+        
+        # Keep image order, dropping failures and repeats within the slide
+        keys = [await future for future in futures]
+        image_keys = list(dict.fromkeys(key for key in keys if key is not None))
+        logger.debug("Slide %d: %d unique images", slide_num, len(image_keys))
         
         return image_keys
     
@@ -217,6 +435,8 @@ class PPTXProcessor:
         """
         Split text into chunks for LLM context.
         
+        Fragments from sparse slides are merged into their neighbours.
+        
         Args:
             text: Full slide text
             
@@ -227,11 +447,11 @@ class PPTXProcessor:
             return []
         
         chunks = self.text_splitter.split_text(text)
-        return chunks
+        return _merge_tiny_chunks(chunks, MIN_CHUNK_SIZE, self.chunk_size + CHUNK_SIZE_SLACK)
     
     async def process_pptx(
         self,
-        pptx_bytes: bytes,
+        pptx: bytes | str,
         user_id: str,
         thread_id: str,
         filename: str,
@@ -240,7 +460,7 @@ class PPTXProcessor:
         Process a PPTX file, extracting text chunks and uploading images.
         
         Args:
-            pptx_bytes: Raw PPTX file content
+            pptx: Raw PPTX file content, or a path to a local PPTX file
             user_id: User identifier for S3 organization
             thread_id: Thread identifier for S3 organization
             filename: Original filename of the PPTX
@@ -248,25 +468,41 @@ class PPTXProcessor:
         Returns:
             List of DocumentChunk objects ready for database storage
         """
-        # Extract slides in a thread to avoid blocking
-        slides_data = await asyncio.to_thread(self._extract_slides, pptx_bytes)
+        # Upload each slide's images as soon as the slide is extracted, while
+        # later slides are still being parsed (bounded by the upload
+        # semaphore). Only the text is kept, so image bytes are released once
+        # their slide is uploaded, and extraction waits while SLIDE_PREFETCH
+        # slides are still uploading
+        slides: list[tuple[int, str, asyncio.Task]] = []
+        window = asyncio.Semaphore(SLIDE_PREFETCH)
+        
+        async def _upload_slide(slide_data: PageData) -> list[str]:
+            try:
+                return await self._upload_images(
+                    images=slide_data.images,
+                    slide_num=slide_data.page_num,
+                    user_id=user_id,
+                    thread_id=thread_id,
+                    filename=filename,
+                )
+            finally:
+                window.release()
+        
+        async with asyncio.TaskGroup() as tg:
+            async for slide_data in self._iter_slides_async(pptx):
+                logger.debug("Slide %d: %d images to upload", slide_data.page_num, len(slide_data.images))
+                await window.acquire()
+                upload_task = tg.create_task(_upload_slide(slide_data))
+                slides.append((slide_data.page_num, slide_data.text, upload_task))
         
         all_chunks = []
         
-        for slide_data in slides_data:
-            # Upload images for this slide
-            print(f"[PPTX Processor] Slide {slide_data.page_num}: {len(slide_data.images)} images to upload")
-            image_keys = await self._upload_images(
-                images=slide_data.images,
-                slide_num=slide_data.page_num,
-                user_id=user_id,
-                thread_id=thread_id,
-                filename=filename,
-            )
-            print(f"[PPTX Processor] Slide {slide_data.page_num}: uploaded image_keys = {image_keys}")
+        for slide_num, slide_text, upload_task in slides:
+            image_keys = upload_task.result()
+            logger.debug("Slide %d: uploaded image_keys = %s", slide_num, image_keys)
             
             # Chunk the text
-            text_chunks = self._chunk_text(slide_data.text)
+            text_chunks = self._chunk_text(slide_text)
             
             if text_chunks:
                 # Create DocumentChunk for each text chunk
@@ -275,7 +511,7 @@ class PPTXProcessor:
                     chunk_image_keys = image_keys if chunk_idx == 0 else []
                     
                     all_chunks.append(DocumentChunk(
-                        page_num=slide_data.page_num,
+                        page_num=slide_num,
                         chunk_index=chunk_idx,
                         content=chunk_text,
                         image_keys=chunk_image_keys,
@@ -283,9 +519,9 @@ class PPTXProcessor:
             elif image_keys:
                 # Slide has images but no text - create a placeholder chunk
                 all_chunks.append(DocumentChunk(
-                    page_num=slide_data.page_num,
+                    page_num=slide_num,
                     chunk_index=0,
-                    content=f"[Slide {slide_data.page_num + 1}: Contains {len(image_keys)} image(s)]",
+                    content=f"[Slide {slide_num + 1}: Contains {len(image_keys)} image(s)]",
                     image_keys=image_keys,
                 ))
         
@@ -301,7 +537,8 @@ async def process_uploaded_pptx_file(
     """
     Background task to process an uploaded PPTX file.
     
-    Downloads from S3, processes, and stores chunks in the database.
+    Downloads from S3 to a temporary file, processes, and stores chunks in
+    the database.
     
     Args:
         s3_key: S3 key of the uploaded file
@@ -312,7 +549,7 @@ async def process_uploaded_pptx_file(
     Returns:
         Number of chunks created
     """
-    print(f"[PPTX Processor] Starting processing for {filename}")
+    logger.info("Starting processing for %s", filename)
     
     # Import here to avoid circular imports
     try:
@@ -321,22 +558,25 @@ async def process_uploaded_pptx_file(
         from src.api.database import save_document_chunks
     
     try:
-        s3_ops = S3Operations()
-        
-        # Download the PPTX from S3
-        print(f"[PPTX Processor] Downloading {filename} from S3...")
-        pptx_bytes = await s3_ops.download_file(filename, user_id, thread_id)
-        print(f"[PPTX Processor] Downloaded {len(pptx_bytes)} bytes")
+        s3_ops = get_s3_ops()
         
-        # Process the PPTX
-        processor = PPTXProcessor(s3_ops=s3_ops)
-        chunks = await processor.process_pptx(
-            pptx_bytes=pptx_bytes,
-            user_id=user_id,
-            thread_id=thread_id,
-            filename=filename,
-        )
-        print(f"[PPTX Processor] Extracted {len(chunks)} chunks")
+        # Download the PPTX from S3 into a temporary file, so python-pptx
+        # reads the archive from disk instead of an in-memory copy
+        with tempfile.TemporaryDirectory(prefix="pptx_processor_") as tmp_dir:
+            pptx_path = os.path.join(tmp_dir, "presentation.pptx")
+            logger.info("Downloading %s from S3...", filename)
+            pptx_size = await s3_ops.download_file_to_path(filename, user_id, thread_id, pptx_path)
+            logger.info("Downloaded %d bytes", pptx_size)
+            
+            # Process the PPTX
+            processor = PPTXProcessor(s3_ops=s3_ops)
+            chunks = await processor.process_pptx(
+                pptx=pptx_path,
+                user_id=user_id,
+                thread_id=thread_id,
+                filename=filename,
+            )
+        logger.info("Extracted %d chunks", len(chunks))
         
         # Save to database
         chunk_dicts = [chunk.to_dict() for chunk in chunks]
@@ -347,10 +587,8 @@ async def process_uploaded_pptx_file(
             chunks=chunk_dicts,
         )
         
-        print(f"[PPTX Processor] Saved {saved_count} chunks to database for {filename}")
+        logger.info("Saved %d chunks to database for %s", saved_count, filename)
         return saved_count
-    except Exception as e:
-        print(f"[PPTX Processor] Error processing {filename}: {e}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        logger.exception("Error processing %s", filename)
         raise
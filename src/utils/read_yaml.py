@@ -1,8 +1,18 @@
 # Read a yaml file and return the content by providing the file path from different directories
+from functools import lru_cache
 from pathlib import Path
 import yaml
 
-def read_yaml(file_path):
-    file_path = Path(__file__).parent.parent / file_path
+# libyaml's C loader when PyYAML was built with it, else the pure-Python one
+_SafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# Parsed results are cached per path and modification time, so edited files
+# are re-read; callers must treat them as read-only
+@lru_cache(maxsize=32)
+def _load_yaml(file_path, mtime_ns):
     with open(file_path, 'r') as file:
-        return yaml.safe_load(file)
\ No newline at end of file
+        return yaml.load(file, Loader=_SafeLoader)
+
+def read_yaml(file_path):
+    file_path = (Path(__file__).parent.parent / file_path).resolve()
+    return _load_yaml(file_path, file_path.stat().st_mtime_ns)
@@ -7,14 +7,54 @@ folder hierarchy: {prefix}/{user_id}/{thread_id}/{filename}
 
 import asyncio
 import os
-from typing import BinaryIO, Optional
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from io import BytesIO
+from typing import Any, AsyncIterator, BinaryIO, Optional
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# HTTP connections kept per S3 client; sized above the concurrent image and
+# upload fan-outs so parallel worker-thread requests don't discard connections
+S3_MAX_POOL_CONNECTIONS = 64
+
+# Uploads of 8 MB or more (large extracted images, PDFs, presentations) are
+# sent as multipart uploads with up to 10 parts in flight at once; smaller
+# in-memory payloads go up in a single PUT (see _put_bytes)
+UPLOAD_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=10,
+    use_threads=True,
+)
+
+# Downloads to disk of 8 MB or more are fetched as concurrent byte ranges
+DOWNLOAD_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True,
+)
+
+
+# file_exists results are remembered per S3 key and per process: only
+# successful HEADs and definitive 404s, hits for a few seconds and misses
+# more briefly since the object may be about to be uploaded. Uploads and
+# deletes through this instance update the cache; a delete through another
+# worker can go unnoticed here for up to _EXISTS_TTL seconds
+_EXISTS_TTL = 10.0
+_MISSING_TTL = 5.0
+_EXISTS_CACHE_MAXSIZE = 10_000
+
 
 # Allowed file extensions and their content types
 ALLOWED_FILE_TYPES = {
@@ -31,6 +71,86 @@ ALLOWED_FILE_TYPES = {
 }
 
 
+@lru_cache(maxsize=256)
+def _content_type_for_ext(ext: str) -> Optional[str]:
+    """Content type for an allowed extension in any case, or None."""
+    return ALLOWED_FILE_TYPES.get(ext) or ALLOWED_FILE_TYPES.get(ext.lower())
+
+
+def _allowed_content_type(filename: str) -> Optional[str]:
+    """
+    Get the content type for a filename's extension, if the type is allowed.
+    
+    The extension is sliced out once and looked up through a small cache, so
+    classifying a batch of files doesn't lowercase the same suffixes again.
+    
+    Args:
+        filename: Name of the file
+        
+    Returns:
+        The content type, or None if the file type is not allowed
+    """
+    # Same extension as os.path.splitext: a dot that starts the name, or one
+    # in a directory part, doesn't count
+    dot = filename.rfind(".")
+    slash = filename.rfind("/")
+    if dot <= slash + 1:
+        return None
+    return _content_type_for_ext(filename[dot:])
+
+
+# boto3 clients are thread-safe, so one client (and its connection pool) is
+# shared by every S3Operations instance using the same profile and region
+_CLIENT_CACHE: dict[tuple[Optional[str], Optional[str]], Any] = {}
+_CLIENT_CACHE_LOCK = threading.Lock()
+
+
+def _get_s3_client(profile_name: Optional[str], region_name: Optional[str] = None):
+    """
+    Get the shared S3 client for a profile and region, creating it on first use.
+    
+    Args:
+        profile_name: AWS profile to authenticate with
+        region_name: AWS region, or None for the profile's default
+        
+    Returns:
+        boto3 S3 client
+    """
+    cache_key = (profile_name, region_name)
+    client = _CLIENT_CACHE.get(cache_key)
+    if client is None:
+        with _CLIENT_CACHE_LOCK:
+            client = _CLIENT_CACHE.get(cache_key)
+            if client is None:
+                # Create boto3 session with SSO profile
+                session = boto3.Session(profile_name=profile_name, region_name=region_name)
+                client = _CLIENT_CACHE[cache_key] = session.client(
+                    "s3",
+                    config=Config(
+                        max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                        retries={"max_attempts": 3, "mode": "adaptive"},
+                    ),
+                )
+    return client
+
+
+@lru_cache(maxsize=1)
+def _get_s3_executor() -> ThreadPoolExecutor:
+    """
+    Create the thread pool blocking boto3 calls run on, on first use.
+    
+    It is sized to the client's connection pool, so S3 concurrency isn't
+    capped by (or competing for) the event loop's default executor.
+    """
+    return ThreadPoolExecutor(max_workers=S3_MAX_POOL_CONNECTIONS, thread_name_prefix="s3")
+
+
+async def _run_blocking(func, *args, **kwargs):
+    """Run a blocking boto3 call on the S3 thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_s3_executor(), partial(func, *args, **kwargs))
+
+
 class S3Operations:
     """
     Handles S3 file operations with SSO profile authentication.
@@ -64,9 +184,18 @@ class S3Operations:
         if not self.bucket_name:
             raise ValueError("S3_BUCKET_NAME environment variable is required")
         
-        # Create boto3 session with SSO profile
-        self._session = boto3.Session(profile_name=self.profile_name)
-        self._s3_client = self._session.client("s3")
+        self._s3_client = _get_s3_client(self.profile_name)
+        
+        # s3_key -> (expires_at, exists), most recently checked last
+        self._exists_cache: OrderedDict[str, tuple[float, bool]] = OrderedDict()
+    
+    def _remember_exists(self, s3_key: str, exists: bool) -> None:
+        """Record whether a key exists, evicting the oldest entries when full."""
+        ttl = _EXISTS_TTL if exists else _MISSING_TTL
+        self._exists_cache[s3_key] = (time.monotonic() + ttl, exists)
+        self._exists_cache.move_to_end(s3_key)
+        while len(self._exists_cache) > _EXISTS_CACHE_MAXSIZE:
+            self._exists_cache.popitem(last=False)
     
     def _build_s3_key(self, user_id: str, thread_id: str, filename: str) -> str:
         """Build the full S3 key for a file."""
@@ -76,13 +205,31 @@ class S3Operations:
     
     def _get_content_type(self, filename: str) -> str:
         """Get the content type based on file extension."""
-        ext = os.path.splitext(filename)[1].lower()
-        return ALLOWED_FILE_TYPES.get(ext, "application/octet-stream")
+        return _allowed_content_type(filename) or "application/octet-stream"
     
     def _validate_file_type(self, filename: str) -> bool:
         """Validate that the file type is allowed."""
-        ext = os.path.splitext(filename)[1].lower()
-        return ext in ALLOWED_FILE_TYPES
+        return _allowed_content_type(filename) is not None
+    
+    def _put_bytes(self, s3_key: str, data: bytes, content_type: str) -> None:
+        """Upload in-memory content to S3 (blocking; run in a worker thread)."""
+        if len(data) < UPLOAD_TRANSFER_CONFIG.multipart_threshold:
+            # Small payloads go up in a single PUT, skipping the transfer
+            # manager and the BytesIO wrapper it needs
+            self._s3_client.put_object(
+                Bucket=self.bucket_name,
+                Key=s3_key,
+                Body=data,
+                ContentType=content_type,
+            )
+        else:
+            self._s3_client.upload_fileobj(
+                BytesIO(data),
+                self.bucket_name,
+                s3_key,
+                ExtraArgs={"ContentType": content_type},
+                Config=UPLOAD_TRANSFER_CONFIG,
+            )
     
     async def upload_file(
         self,
@@ -107,35 +254,37 @@ class S3Operations:
             ValueError: If file type is not allowed
             ClientError: If S3 upload fails
         """
-        if not self._validate_file_type(filename):
+        content_type = _allowed_content_type(filename)
+        if content_type is None:
             allowed = ", ".join(ALLOWED_FILE_TYPES.keys())
             raise ValueError(f"File type not allowed. Allowed types: {allowed}")
         
         s3_key = self._build_s3_key(user_id, thread_id, filename)
-        content_type = self._get_content_type(filename)
         
-        # Convert bytes to file-like object if needed
         if isinstance(file_data, bytes):
-            from io import BytesIO
-            file_obj = BytesIO(file_data)
             file_size = len(file_data)
+            
+            def _upload():
+                self._put_bytes(s3_key, file_data, content_type)
         else:
             file_obj = file_data
             # Get file size
             file_obj.seek(0, 2)  # Seek to end
             file_size = file_obj.tell()
             file_obj.seek(0)  # Seek back to start
-        
-        # Run S3 upload in thread pool to not block async event loop
-        def _upload():
-            self._s3_client.upload_fileobj(
-                file_obj,
-                self.bucket_name,
-                s3_key,
-                ExtraArgs={"ContentType": content_type}
-            )
-        
-        await asyncio.to_thread(_upload)
+            
+            # Run S3 upload in thread pool to not block async event loop
+            def _upload():
+                self._s3_client.upload_fileobj(
+                    file_obj,
+                    self.bucket_name,
+                    s3_key,
+                    ExtraArgs={"ContentType": content_type},
+                    Config=UPLOAD_TRANSFER_CONFIG,
+                )
+        
+        await _run_blocking(_upload)
+        self._remember_exists(s3_key, True)
         
         return {
             "key": s3_key,
@@ -181,6 +330,52 @@ class S3Operations:
         
         return processed_results
     
+    async def upload_many_bytes(
+        self,
+        items: list[tuple[bytes, str, str]],
+        user_id: str,
+        thread_id: str,
+        semaphore: Optional[asyncio.Semaphore] = None,
+    ) -> list[dict]:
+        """
+        Upload several in-memory files to S3 in parallel.
+        
+        Unlike upload_files, callers pass content types they have already
+        resolved, so no per-file validation or extension lookup is done.
+        
+        Args:
+            items: List of tuples (file_data, filename, content_type)
+            user_id: User identifier
+            thread_id: Thread identifier
+            semaphore: Optional semaphore bounding concurrent uploads
+            
+        Returns:
+            List of upload result dicts (key, filename, size), or dicts with
+            filename and error for uploads that failed, in input order
+        """
+        key_prefix = self._build_s3_key(user_id, thread_id, "")
+        
+        async def _upload(file_data: bytes, filename: str, content_type: str) -> dict:
+            s3_key = key_prefix + filename
+            if semaphore is None:
+                await _run_blocking(self._put_bytes, s3_key, file_data, content_type)
+            else:
+                async with semaphore:
+                    await _run_blocking(self._put_bytes, s3_key, file_data, content_type)
+            self._remember_exists(s3_key, True)
+            return {"key": s3_key, "filename": filename, "size": len(file_data)}
+        
+        results = await asyncio.gather(
+            *(_upload(*item) for item in items),
+            return_exceptions=True,
+        )
+        
+        # Convert exceptions to error dicts, as upload_files does
+        return [
+            {"filename": item[1], "error": str(result)} if isinstance(result, Exception) else result
+            for item, result in zip(items, results)
+        ]
+    
     async def download_file(
         self,
         filename: str,
@@ -201,17 +396,87 @@ class S3Operations:
         Raises:
             ClientError: If file doesn't exist or download fails
         """
-        from io import BytesIO
-        
         s3_key = self._build_s3_key(user_id, thread_id, filename)
         buffer = BytesIO()
         
         def _download():
             self._s3_client.download_fileobj(self.bucket_name, s3_key, buffer)
         
-        await asyncio.to_thread(_download)
-        buffer.seek(0)
-        return buffer.read()
+        await _run_blocking(_download)
+        # getvalue() hands back the buffer's bytes without the extra copy
+        # that seek(0) + read() makes
+        return buffer.getvalue()
+    
+    async def download_file_to_path(
+        self,
+        filename: str,
+        user_id: str,
+        thread_id: str,
+        path: str,
+    ) -> int:
+        """
+        Download a file from S3 straight to a local path.
+        
+        Large files are fetched as concurrent ranged GETs and written to
+        disk as they arrive, so the content is never held in memory whole.
+        
+        Args:
+            filename: Name of the file
+            user_id: User identifier
+            thread_id: Thread identifier
+            path: Local path to write the file to
+            
+        Returns:
+            Size of the downloaded file in bytes
+            
+        Raises:
+            ClientError: If file doesn't exist or download fails
+        """
+        s3_key = self._build_s3_key(user_id, thread_id, filename)
+        
+        def _download():
+            self._s3_client.download_file(
+                self.bucket_name, s3_key, path, Config=DOWNLOAD_TRANSFER_CONFIG
+            )
+            return os.path.getsize(path)
+        
+        return await _run_blocking(_download)
+    
+    async def iter_file_chunks(
+        self,
+        filename: str,
+        user_id: str,
+        thread_id: str,
+        chunk_size: int = 65536,
+    ) -> AsyncIterator[bytes]:
+        """
+        Stream a file from S3 in chunks without holding it in memory.
+        
+        Args:
+            filename: Name of the file
+            user_id: User identifier
+            thread_id: Thread identifier
+            chunk_size: Bytes per yielded chunk (default: 64 KiB)
+            
+        Yields:
+            Consecutive chunks of the file content
+            
+        Raises:
+            ClientError: If file doesn't exist or download fails
+        """
+        s3_key = self._build_s3_key(user_id, thread_id, filename)
+        response = await _run_blocking(
+            self._s3_client.get_object, Bucket=self.bucket_name, Key=s3_key
+        )
+        body = response["Body"]
+        chunks = body.iter_chunks(chunk_size)
+        
+        try:
+            # Each read blocks on the socket, so pull chunks in a worker thread
+            while (chunk := await _run_blocking(next, chunks, None)) is not None:
+                yield chunk
+        finally:
+            body.close()
     
     async def download_by_key(self, s3_key: str) -> bytes:
         """
@@ -229,16 +494,13 @@ class S3Operations:
         Raises:
             ClientError: If file doesn't exist or download fails
         """
-        from io import BytesIO
-        
         buffer = BytesIO()
         
         def _download():
             self._s3_client.download_fileobj(self.bucket_name, s3_key, buffer)
         
-        await asyncio.to_thread(_download)
-        buffer.seek(0)
-        return buffer.read()
+        await _run_blocking(_download)
+        return buffer.getvalue()
     
     async def get_presigned_url(
         self,
@@ -246,6 +508,7 @@ class S3Operations:
         user_id: str,
         thread_id: str,
         expiration: int = 3600,
+        attachment: bool = False,
     ) -> str:
         """
         Generate a presigned URL for downloading a file.
@@ -255,20 +518,100 @@ class S3Operations:
             user_id: User identifier
             thread_id: Thread identifier
             expiration: URL expiration time in seconds (default: 1 hour)
+            attachment: Have S3 serve the file as a download under its
+                filename (Content-Disposition: attachment) rather than inline
             
         Returns:
             Presigned URL string
         """
         s3_key = self._build_s3_key(user_id, thread_id, filename)
+        params = {"Bucket": self.bucket_name, "Key": s3_key}
+        if attachment:
+            params["ResponseContentDisposition"] = f'attachment; filename="{filename}"'
+            params["ResponseContentType"] = self._get_content_type(filename)
         
         def _generate_url():
             return self._s3_client.generate_presigned_url(
                 "get_object",
-                Params={"Bucket": self.bucket_name, "Key": s3_key},
+                Params=params,
                 ExpiresIn=expiration,
             )
         
-        return await asyncio.to_thread(_generate_url)
+        return await _run_blocking(_generate_url)
+    
+    async def get_presigned_urls_by_key(
+        self,
+        s3_keys: list[str],
+        expiration: int = 3600,
+    ) -> list[str]:
+        """
+        Generate presigned download URLs for several files by their S3 keys.
+        
+        Signing is local to the client and needs no request to S3, so all
+        keys are signed in one worker-thread call with the shared client.
+        
+        Args:
+            s3_keys: Full S3 keys of the files
+            expiration: URL expiration time in seconds (default: 1 hour)
+            
+        Returns:
+            Presigned URL strings, in the same order as s3_keys
+        """
+        def _generate_urls():
+            return [
+                self._s3_client.generate_presigned_url(
+                    "get_object",
+                    Params={"Bucket": self.bucket_name, "Key": s3_key},
+                    ExpiresIn=expiration,
+                )
+                for s3_key in s3_keys
+            ]
+        
+        return await _run_blocking(_generate_urls)
+    
+    async def get_presigned_upload_url(
+        self,
+        filename: str,
+        user_id: str,
+        thread_id: str,
+        expiration: int = 900,
+    ) -> dict:
+        """
+        Generate a presigned URL for uploading a file directly to S3.
+        
+        The client must send the returned content type as the Content-Type
+        header of its PUT request, since it is part of the signature.
+        
+        Args:
+            filename: Name of the file
+            user_id: User identifier
+            thread_id: Thread identifier
+            expiration: URL expiration time in seconds (default: 15 minutes)
+            
+        Returns:
+            Dict with url, key and content_type
+            
+        Raises:
+            ValueError: If file type is not allowed
+        """
+        content_type = _allowed_content_type(filename)
+        if content_type is None:
+            allowed = ", ".join(ALLOWED_FILE_TYPES.keys())
+            raise ValueError(f"File type not allowed. Allowed types: {allowed}")
+        
+        s3_key = self._build_s3_key(user_id, thread_id, filename)
+        
+        def _generate_url():
+            return self._s3_client.generate_presigned_url(
+                "put_object",
+                Params={"Bucket": self.bucket_name, "Key": s3_key, "ContentType": content_type},
+                ExpiresIn=expiration,
+            )
+        
+        url = await _run_blocking(_generate_url)
+        # The client is about to upload directly, so forget any earlier answer
+        self._exists_cache.pop(s3_key, None)
+        return {"url": url, "key": s3_key, "content_type": content_type}
     
     async def list_files(
         self,
@@ -294,7 +637,7 @@ class S3Operations:
             )
             return response.get("Contents", [])
         
-        objects = await asyncio.to_thread(_list_objects)
+        objects = await _run_blocking(_list_objects)
         
         files = []
         for obj in objects:
@@ -335,7 +678,13 @@ class S3Operations:
         def _delete():
             self._s3_client.delete_object(Bucket=self.bucket_name, Key=s3_key)
         
-        await asyncio.to_thread(_delete)
+        try:
+            await _run_blocking(_delete)
+        except BaseException:
+            # The object may or may not be gone; make the next check ask S3
+            self._exists_cache.pop(s3_key, None)
+            raise
+        self._remember_exists(s3_key, False)
         
         return {
             "deleted": True,
@@ -348,20 +697,34 @@ class S3Operations:
         filename: str,
         user_id: str,
         thread_id: str,
+        use_cache: bool = True,
     ) -> bool:
         """
         Check if a file exists in S3.
         
+        Recent answers are served from a local cache instead of another
+        head_object request; uploads and deletes through this instance
+        update it, and failed checks are never cached.
+        
         Args:
             filename: Name of the file
             user_id: User identifier
             thread_id: Thread identifier
+            use_cache: Set to False to always ask S3 (e.g. after a direct
+                upload through a presigned URL)
             
         Returns:
             True if file exists, False otherwise
         """
         s3_key = self._build_s3_key(user_id, thread_id, filename)
         
+        if use_cache:
+            entry = self._exists_cache.get(s3_key)
+            if entry is not None:
+                expires_at, exists = entry
+                if expires_at > time.monotonic():
+                    return exists
+        
         def _head_object():
             try:
                 self._s3_client.head_object(Bucket=self.bucket_name, Key=s3_key)
@@ -373,7 +736,26 @@ class S3Operations:
                     return False
                 raise
             except Exception:
-                # If we can't check, assume it doesn't exist
-                return False
-        
-        return await asyncio.to_thread(_head_object)
+                # Unknown (e.g. a network error); not a definitive answer
+                return None
+        
+        exists = await _run_blocking(_head_object)
+        if exists is None:
+            # If we can't check, assume it doesn't exist
+            return False
+        self._remember_exists(s3_key, exists)
+        return exists
+
+
+@lru_cache(maxsize=1)
+def get_s3_ops() -> S3Operations:
+    """
+    Get the process-wide S3Operations instance, creating it on first use.
+    
+    Sharing one instance keeps a single boto3 session, client and connection
+    pool for every upload, download and presign in the process.
+    
+    Raises:
+        ValueError: If S3_BUCKET_NAME is not configured
+    """
+    return S3Operations()